@@ -0,0 +1,259 @@
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from types import SimpleNamespace
+
+from pymongo import monitoring
+
+# Drives the database layer with a synthetic chat workload and reports write
+# throughput plus p50/p95/p99 latency for every read function and mode.
+#
+#   python -m benchmarks.bench_database                 # local mongod
+#   python -m benchmarks.bench_database --memory        # mongomock-motor
+#
+# The benchmark uses its own database and drops it before starting: an
+# exported MONGO_DB is only kept when it starts with chatfight_bench, any
+# other name (e.g. the bot's own from .env) is replaced by chatfight_bench.
+
+MODES = ("today", "week", "month", "year", "overall")
+
+BENCH_DB = "chatfight_bench"
+
+
+# =========================
+# COMMAND CAPTURE (for explain)
+# =========================
+
+class CommandRecorder(monitoring.CommandListener):
+
+    def __init__(self):
+        self.commands = []
+
+    def started(self, event):
+        if event.command_name in ("aggregate", "find", "count"):
+            command = {
+                key: value for key, value in event.command.items()
+                if not key.startswith("$") and key not in ("lsid", "txnNumber")
+            }
+            self.commands.append((event.database_name, command))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def _stages(plan):
+    # Flattens every "stage" name found anywhere in an explain output
+    if isinstance(plan, dict):
+        for key, value in plan.items():
+            if key == "stage" and isinstance(value, str):
+                yield value
+            else:
+                yield from _stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _stages(item)
+
+
+# =========================
+# MEASUREMENT
+# =========================
+
+def percentiles(samples):
+    if len(samples) < 2:
+        value = samples[0] if samples else 0
+        return value, value, value
+
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return cuts[49], cuts[94], cuts[98]
+
+
+async def drive_writes(database, workload, rate, duration):
+
+    # Calls increment_message at `rate` msg/s (0 = as fast as possible) with
+    # the periodic flush running like the bot's job queue does
+    async def flusher():
+        while True:
+            await asyncio.sleep(database.Config.FLUSH_INTERVAL_MS / 1000)
+            await database.flush_pending_messages()
+
+    flush_task = asyncio.create_task(flusher())
+    latencies = []
+    sent = 0
+    started = time.perf_counter()
+    deadline = started + duration
+
+    while time.perf_counter() < deadline:
+        user_id, group_id = workload.message()
+        user = SimpleNamespace(id=user_id, full_name=f"User {user_id}", username="")
+        chat = SimpleNamespace(id=group_id, title=f"Group {group_id}")
+
+        call_started = time.perf_counter()
+        await database.increment_message(user, chat)
+        latencies.append((time.perf_counter() - call_started) * 1000)
+        sent += 1
+
+        if rate:
+            delay = started + sent / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        elif sent % 500 == 0:
+            await asyncio.sleep(0)
+
+    flush_task.cancel()
+    await database.flush_pending_messages()
+
+    return sent / (time.perf_counter() - started), latencies
+
+
+async def time_reads(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+async def explain(database, recorder, func):
+
+    # Re-runs the commands a read issued through explain and reports which
+    # access stages the winning plans used
+    recorder.commands.clear()
+    await func()
+
+    stages = set()
+    for db_name, command in recorder.commands:
+        plan = await database.get_client()[db_name].command(
+            {"explain": command, "verbosity": "queryPlanner"}
+        )
+        stages.update(_stages(plan))
+
+    if "COLLSCAN" in stages:
+        return "COLLSCAN"
+    if {"IXSCAN", "IDHACK", "COUNT_SCAN", "DISTINCT_SCAN"} & stages:
+        return "index"
+    return "-"
+
+
+def read_functions(database, group_id, user_id, mode):
+
+    # (name, public call, uncached Mongo call)
+    return [
+        ("get_leaderboard",
+         lambda: database.get_leaderboard(group_id, mode),
+         lambda: database._query_leaderboard(group_id, mode, 10)),
+        ("get_global_leaderboard",
+         lambda: database.get_global_leaderboard(mode),
+         lambda: database._query_global_leaderboard(mode, 10)),
+        ("get_top_groups",
+         lambda: database.get_top_groups(mode),
+         lambda: database._query_top_groups(mode, 10)),
+        ("get_user_total_messages",
+         lambda: database.get_user_total_messages(user_id, mode),
+         lambda: database.get_user_total_messages.__wrapped__(user_id, mode)),
+        ("get_user_groups_stats",
+         lambda: database.get_user_groups_stats(user_id, mode),
+         lambda: database.get_user_groups_stats.__wrapped__(user_id, mode)),
+        ("get_total_group_messages",
+         lambda: database.get_total_group_messages(group_id, mode),
+         lambda: database.get_total_group_messages.__wrapped__(group_id, mode)),
+        ("get_total_global_messages",
+         lambda: database.get_total_global_messages(mode),
+         lambda: database.get_total_global_messages.__wrapped__(mode)),
+    ]
+
+
+# =========================
+# RUN
+# =========================
+
+async def run(args, recorder):
+    import database
+    from benchmarks.workload import Workload
+
+    await database.get_client().drop_database(database.get_db().name)
+    await database.create_indexes()
+
+    workload = Workload(args.users, args.groups, seed=args.seed)
+
+    if args.days:
+        print(f"Loading {args.days} days x {args.messages_per_day:,} messages of history...")
+        history = workload.history(args.days, args.messages_per_day, database._get_today() - 1)
+        items = list(history.items())
+        for i in range(0, len(items), 5000):
+            await database.write_message_counts(dict(items[i:i + 5000]))
+        # mongomock has no $merge, in memory every mode reads daily documents
+        if not args.memory:
+            await database.rollup_months()
+
+    rate, latencies = await drive_writes(database, workload, args.rate, args.duration)
+    p50, p95, p99 = percentiles(latencies)
+    print(
+        f"\nincrement_message: {rate:,.0f} msg/s  "
+        f"p50 {p50:.3f}ms  p95 {p95:.3f}ms  p99 {p99:.3f}ms\n"
+    )
+
+    group_id = -1
+    user_id = workload.message()[0]
+
+    print(
+        f"{'function':<28}{'mode':<9}{'source':<8}"
+        f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  plan"
+    )
+
+    for mode in MODES:
+        for name, public, uncached in read_functions(database, group_id, user_id, mode):
+            for source, func in (("bot", public), ("mongo", uncached)):
+                p50, p95, p99 = percentiles(await time_reads(func, args.repeat))
+                plan = "" if source == "bot" or args.memory else await explain(database, recorder, func)
+                print(
+                    f"{name:<28}{mode:<9}{source:<8}"
+                    f"{p50:>10.3f}{p95:>10.3f}{p99:>10.3f}  {plan}"
+                )
+
+    if not args.keep:
+        await database.get_client().drop_database(database.get_db().name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the database layer")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--groups", type=int, default=200)
+    parser.add_argument("--days", type=int, default=14, help="days of history to preload")
+    parser.add_argument("--messages-per-day", type=int, default=20000)
+    parser.add_argument("--rate", type=float, default=0, help="target msg/s, 0 = unthrottled")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of live writes")
+    parser.add_argument("--repeat", type=int, default=50, help="calls per read function")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--memory", action="store_true", help="use mongomock-motor instead of mongod")
+    parser.add_argument("--keep", action="store_true", help="keep the bench database")
+    args = parser.parse_args()
+
+    if not os.environ.get("MONGO_DB", "").startswith(BENCH_DB):
+        os.environ["MONGO_DB"] = BENCH_DB
+
+    if args.memory:
+        # mongomock-motor's with_options() returns a sync collection, so
+        # routed reads must keep the client's (primary) default
+        os.environ["MONGO_READ_PREFERENCE"] = "primary"
+        os.environ["MONGO_READ_ROUTING"] = ""
+
+        import mongomock_motor
+        import motor.motor_asyncio
+
+        motor.motor_asyncio.AsyncIOMotorClient = mongomock_motor.AsyncMongoMockClient
+
+    # Must be registered before the client is created
+    recorder = CommandRecorder()
+    monitoring.register(recorder)
+
+    asyncio.run(run(args, recorder))
+
+
+if __name__ == "__main__":
+    main()
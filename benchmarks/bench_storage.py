@@ -0,0 +1,105 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Compares the "daily" and "bucketed" storage layouts: each layout is loaded
+# with the same synthetic history in its own database (MONGO_DB is switched
+# per child process), then sizes and read latencies are reported.
+#
+#   python -m benchmarks.bench_storage --days 30 --messages-per-day 20000
+
+MODES = ("daily", "bucketed")
+
+
+def time_calls(func, repeat):
+    async def run():
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            await func()
+            samples.append((time.perf_counter() - started) * 1000)
+        return round(statistics.median(samples), 3)
+    return run()
+
+
+async def child(args):
+    import database
+    from benchmarks.workload import Workload
+
+    await database.get_client().drop_database(database.get_db().name)
+    await database.create_indexes()
+
+    workload = Workload(args.users, args.groups, seed=args.seed)
+    today = database._get_today()
+    counts = workload.history(args.days, args.messages_per_day, today)
+
+    items = list(counts.items())
+    for i in range(0, len(items), 5000):
+        await database.write_message_counts(dict(items[i:i + 5000]))
+
+    col = database._message_writer()[0]
+    stats = (await col.aggregate(
+        [{"$collStats": {"storageStats": {}}}]
+    ).to_list(None))[0]["storageStats"]
+
+    # Bypass the result cache, the point is to time Mongo
+    group_id, user_id = -1, workload.message()[0]
+    queries = {
+        "leaderboard_today": lambda: database._query_leaderboard(group_id, "today", 10),
+        "leaderboard_week": lambda: database._query_leaderboard(group_id, "week", 10),
+        "group_total_week": lambda: database.get_total_group_messages.__wrapped__(group_id, "week"),
+        "user_groups_week": lambda: database.get_user_groups_stats.__wrapped__(user_id, "week"),
+    }
+
+    report = {
+        "documents": stats["count"],
+        "data_mb": round(stats["size"] / 2 ** 20, 2),
+        "index_mb": round(stats["totalIndexSize"] / 2 ** 20, 2),
+    }
+
+    for name, func in queries.items():
+        report[f"{name}_ms"] = await time_calls(func, args.repeat)
+
+    if not args.keep:
+        await database.get_client().drop_database(database.get_db().name)
+
+    print(json.dumps(report))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare daily and bucketed storage")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--groups", type=int, default=200)
+    parser.add_argument("--days", type=int, default=14)
+    parser.add_argument("--messages-per-day", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--keep", action="store_true", help="keep the bench databases")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        asyncio.run(child(args))
+        return
+
+    results = {}
+    for mode in MODES:
+        env = dict(os.environ, STORAGE_MODE=mode, MONGO_DB=f"chatfight_bench_{mode}")
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_storage", "--child"] + sys.argv[1:],
+            env=env, check=True, capture_output=True, text=True
+        ).stdout
+        results[mode] = json.loads(output.strip().splitlines()[-1])
+
+    print(f"{'metric':<24}" + "".join(f"{mode:>14}" for mode in MODES))
+    for metric in results[MODES[0]]:
+        print(f"{metric:<24}" + "".join(f"{results[mode][metric]:>14}" for mode in MODES))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import bisect
+import itertools
+import random
+
+
+# =========================
+# SYNTHETIC CHAT WORKLOAD
+# =========================
+
+# Users and groups are drawn from Zipf distributions, so a few groups and a
+# few members carry most of the traffic like in real chats.
+
+def zipf_sampler(n, skew, rng):
+    weights = [1 / (rank ** skew) for rank in range(1, n + 1)]
+    cumulative = list(itertools.accumulate(weights))
+    total = cumulative[-1]
+
+    def sample():
+        return bisect.bisect_left(cumulative, rng.random() * total)
+
+    return sample
+
+
+class Workload:
+
+    def __init__(self, users, groups, skew=1.1, seed=1):
+        self.users = users
+        self.groups = groups
+        self.rng = random.Random(seed)
+        self._user = zipf_sampler(users, skew, self.rng)
+        self._group = zipf_sampler(groups, skew, self.rng)
+
+    def message(self):
+        # Shift the user ranking per group so every group has its own regulars
+        group = self._group()
+        user = (self._user() + group * 7919) % self.users
+
+        return user + 1, -(group + 1)
+
+    def history(self, days, messages_per_day, last_day):
+        # {(user_id, group_id, day): count} for `days` days ending at last_day
+        counts = {}
+
+        for day in range(last_day - days + 1, last_day + 1):
+            for _ in range(messages_per_day):
+                user_id, group_id = self.message()
+                key = (user_id, group_id, day)
+                counts[key] = counts.get(key, 0) + 1
+
+        return counts
@@ -1,7 +1,9 @@
+import asyncio
 import logging
 import html
 
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.error import TelegramError
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
@@ -14,17 +16,37 @@ from telegram.ext import (
 from config import Config
 from database import (
     increment_message,
+    flush_pending_messages,
+    rollup_months,
+    compact_daily,
+    create_indexes,
+    warm_leaderboards,
+    board_stamp,
     get_leaderboard,
     get_user_total_messages,
-    get_total_group_messages
+    get_total_group_messages,
+    get_user_rank,
+    result_ttl
 )
 
 from handlers.topusers import topusers, global_buttons
 from handlers.mytop import mytop, mytop_buttons
 from handlers.topgroups import topgroups, topgroups_buttons
-from handlers.broadcast import broadcast
+from handlers.broadcast import broadcast, resume_broadcasts, stop_broadcasts
+from handlers.profile import profile
 from handlers.logger import log_start, log_bot_status
-from handlers.events import check_event_answer
+from handlers.events import auto_event, check_event_answer
+from handlers import views
+from handlers.debounce import debounced
+from processor import ChatOrderedUpdateProcessor
+from metrics import (
+    InstrumentedRequest,
+    enabled as metrics_enabled,
+    instrument_handlers,
+    start_metrics_server,
+    stop_metrics_server,
+    timed
+)
 
 
 # =========================
@@ -34,7 +56,48 @@ logging.basicConfig(level=logging.WARNING)
 
 Config.validate()
 
-app = ApplicationBuilder().token(Config.BOT_TOKEN).build()
+
+# =========================
+# STARTUP / SHUTDOWN
+# =========================
+async def flush_messages_job(context: ContextTypes.DEFAULT_TYPE):
+    await flush_pending_messages()
+
+
+async def rollup_months_job(context: ContextTypes.DEFAULT_TYPE):
+    await rollup_months()
+
+    if Config.RETENTION_DAYS:
+        await compact_daily(Config.RETENTION_DAYS)
+
+
+async def ensure_indexes():
+    try:
+        await create_indexes()
+    except Exception:
+        logging.exception("Index bootstrap failed")
+
+
+async def on_startup(application):
+    await start_metrics_server()
+
+    # Building a new index on a big collection takes a while, the bot
+    # serves updates meanwhile
+    if Config.MONGO_INDEX_BOOTSTRAP == "background" and application.bot_data.get("primary", True):
+        application.bot_data["index_task"] = asyncio.create_task(ensure_indexes())
+
+    await warm_leaderboards(application.bot_data.get("owns_chat"))
+
+    # Only one process resumes broadcasts when running several workers
+    if application.bot_data.get("primary", True):
+        await resume_broadcasts(application)
+
+
+async def on_shutdown(application):
+    stop_broadcasts()
+    await flush_pending_messages()
+    stop_metrics_server()
+
 
 START_IMAGE = "https://files.catbox.moe/sscl7n.jpg"
 SUPPORT_LINK = Config.SUPPORT_GROUP
@@ -109,21 +172,21 @@ async def back_home(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def today_total(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_chat.type != "private":
         return
-    total = get_user_total_messages(update.effective_user.id, "today")
+    total = await get_user_total_messages(update.effective_user.id, "today")
     await update.message.reply_text(f"Today Messages: {total:,}")
 
 
 async def week_total(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_chat.type != "private":
         return
-    total = get_user_total_messages(update.effective_user.id, "week")
+    total = await get_user_total_messages(update.effective_user.id, "week")
     await update.message.reply_text(f"Week Messages: {total:,}")
 
 
 async def overall_total(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_chat.type != "private":
         return
-    total = get_user_total_messages(update.effective_user.id, "overall")
+    total = await get_user_total_messages(update.effective_user.id, "overall")
     await update.message.reply_text(f"Overall Messages: {total:,}")
 
 
@@ -141,7 +204,7 @@ async def count_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if message.sender_chat or not message.from_user or message.from_user.is_bot:
         return
 
-    increment_message(message.from_user, message.chat)
+    await increment_message(message.from_user, message.chat)
 
 
 # =========================
@@ -155,17 +218,31 @@ async def rankings(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await send_leaderboard(update, context, "overall")
 
 
-async def send_leaderboard(update, context, mode):
+@timed
+async def send_leaderboard(update, context, mode, page=0):
     group_id = update.effective_chat.id
-    data = get_leaderboard(group_id, mode)
-    total_messages = get_total_group_messages(group_id, mode)
+    query = update.callback_query
+
+    # Nothing new in this group since the message was last drawn
+    state = ("rank", mode, page, board_stamp(("group", group_id), mode))
+    if query and views.is_current(query, state, result_ttl(mode)):
+        return
+
+    offset = page * views.PAGE_SIZE
+
+    # One extra row tells whether there is a next page
+    data = await get_leaderboard(group_id, mode, views.PAGE_SIZE + 1, offset)
+    total_messages = await get_total_group_messages(group_id, mode)
+
+    has_next = len(data) > views.PAGE_SIZE and page + 1 < Config.LEADERBOARD_MAX_PAGES
+    data = data[:views.PAGE_SIZE]
 
     text = "LEADERBOARD\n\n"
 
     if not data:
         text += "No data yet.\n"
     else:
-        for i, (user_id, count) in enumerate(data, start=1):
+        for i, (user_id, count) in enumerate(data, start=offset + 1):
             name = f"<a href='tg://user?id={user_id}'>User</a>"
             text += f"{i}. {name} - {count:,}\n"
 
@@ -175,21 +252,28 @@ async def send_leaderboard(update, context, mode):
         InlineKeyboardButton("Overall", callback_data="rank_overall"),
         InlineKeyboardButton("Today", callback_data="rank_today"),
         InlineKeyboardButton("Week", callback_data="rank_week"),
+        InlineKeyboardButton("Month", callback_data="rank_month"),
     ]]
 
+    pages = views.page_buttons("rank", mode, page, has_next)
+    if pages:
+        keyboard.append(pages)
+
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    if update.callback_query:
-        query = update.callback_query
-        await query.answer()
+    if query:
+        if views.is_rendered(query, state, text, reply_markup):
+            return
         try:
             await query.edit_message_text(
                 text=text,
                 parse_mode="HTML",
                 reply_markup=reply_markup
             )
-        except:
-            pass
+        except TelegramError as e:
+            # The message may not show what was recorded for it
+            if "Message is not modified" not in str(e):
+                views.forget(query)
     else:
         await update.message.reply_text(
             text=text,
@@ -202,52 +286,134 @@ async def ranking_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    mode = "overall"
-    if query.data == "rank_today":
-        mode = "today"
-    elif query.data == "rank_week":
-        mode = "week"
+    mode, page = views.parse_page(query.data)
+    await send_leaderboard(update, context, mode, page)
+
+
+# =========================
+# MY RANK
+# =========================
+async def myrank(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_chat.type not in ["group", "supergroup"]:
+        await update.message.reply_text("Use this in a group.")
+        return
+
+    rank = await get_user_rank(update.effective_user.id, update.effective_chat.id)
+
+    if rank is None:
+        await update.message.reply_text("You have no messages here yet.")
+        return
 
-    await send_leaderboard(update, context, mode)
+    position, total = rank
+    await update.message.reply_text(
+        f"Your rank: #{position:,}\nMessages: {total:,}"
+    )
 
 
 # =========================
 # HANDLERS
 # =========================
-app.add_handler(CommandHandler("start", start))
-app.add_handler(CommandHandler("rankings", rankings))
-app.add_handler(CommandHandler("broadcast", broadcast))
-app.add_handler(CommandHandler("mytop", mytop))
-app.add_handler(CommandHandler("topusers", topusers))
-app.add_handler(CommandHandler("topgroups", topgroups))
-
-app.add_handler(CommandHandler("today", today_total))
-app.add_handler(CommandHandler("week", week_total))
-app.add_handler(CommandHandler("overall", overall_total))
-
-app.add_handler(CallbackQueryHandler(settings_menu, pattern="^settings$"))
-app.add_handler(CallbackQueryHandler(back_home, pattern="^back_home$"))
-app.add_handler(CallbackQueryHandler(ranking_buttons, pattern="^rank_"))
-app.add_handler(CallbackQueryHandler(global_buttons, pattern="^g_"))
-app.add_handler(CallbackQueryHandler(mytop_buttons, pattern="^my_"))
-app.add_handler(CallbackQueryHandler(topgroups_buttons, pattern="^tg_"))
-
-app.add_handler(
-    MessageHandler(filters.TEXT & ~filters.COMMAND, count_messages),
-    group=0
-)
+def build_app(primary=True, owns_chat=None):
+
+    # primary: runs the once-per-deployment duties (events, broadcasts)
+    # owns_chat: chat_id predicate when updates are split across workers
+    builder = (
+        ApplicationBuilder()
+        .token(Config.BOT_TOKEN)
+        .concurrent_updates(ChatOrderedUpdateProcessor(Config.UPDATE_CONCURRENCY))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
 
-app.add_handler(
-    MessageHandler(filters.TEXT & ~filters.COMMAND, check_event_answer),
-    group=1
-)
+    if Config.BOT_API_URL:
+        builder = builder.base_url(Config.BOT_API_URL)
 
-app.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, log_bot_status))
-app.add_handler(MessageHandler(filters.StatusUpdate.LEFT_CHAT_MEMBER, log_bot_status))
+    if metrics_enabled():
+        builder = (
+            builder
+            .request(InstrumentedRequest(connection_pool_size=256))
+            .get_updates_request(InstrumentedRequest())
+        )
+
+    app = builder.build()
+    app.bot_data["primary"] = primary
+    app.bot_data["owns_chat"] = owns_chat
+
+    app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("rankings", rankings))
+    app.add_handler(CommandHandler("myrank", myrank))
+    app.add_handler(CommandHandler("broadcast", broadcast))
+    # Non-blocking: the session sleeps for minutes and must not hold the
+    # chat's place in the processor (or a concurrency slot) meanwhile
+    app.add_handler(CommandHandler("profile", profile, block=False))
+    app.add_handler(CommandHandler("mytop", mytop))
+    app.add_handler(CommandHandler("topusers", topusers))
+    app.add_handler(CommandHandler("topgroups", topgroups))
+
+    app.add_handler(CommandHandler("today", today_total))
+    app.add_handler(CommandHandler("week", week_total))
+    app.add_handler(CommandHandler("overall", overall_total))
+
+    app.add_handler(CallbackQueryHandler(settings_menu, pattern="^settings$"))
+    app.add_handler(CallbackQueryHandler(back_home, pattern="^back_home$"))
+    app.add_handler(CallbackQueryHandler(debounced(ranking_buttons), pattern="^rank_", block=False))
+    app.add_handler(CallbackQueryHandler(debounced(global_buttons), pattern="^g_", block=False))
+    app.add_handler(CallbackQueryHandler(debounced(mytop_buttons), pattern="^my_", block=False))
+    app.add_handler(CallbackQueryHandler(debounced(topgroups_buttons), pattern="^tg_", block=False))
+
+    app.add_handler(
+        MessageHandler(filters.TEXT & ~filters.COMMAND, count_messages),
+        group=0
+    )
+
+    app.add_handler(
+        MessageHandler(filters.TEXT & ~filters.COMMAND, check_event_answer),
+        group=1
+    )
+
+    app.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, log_bot_status))
+    app.add_handler(MessageHandler(filters.StatusUpdate.LEFT_CHAT_MEMBER, log_bot_status))
+
+    instrument_handlers(app)
+
+    app.job_queue.run_repeating(
+        flush_messages_job,
+        interval=Config.FLUSH_INTERVAL_MS / 1000,
+        first=Config.FLUSH_INTERVAL_MS / 1000
+    )
+
+    # Only rebuilds anything once per day, right after midnight
+    if primary:
+        app.job_queue.run_repeating(
+            rollup_months_job,
+            interval=Config.ROLLUP_INTERVAL,
+            first=60
+        )
+
+    if primary and Config.EVENT_INTERVAL:
+        app.job_queue.run_repeating(
+            auto_event,
+            interval=Config.EVENT_INTERVAL,
+            first=Config.EVENT_INTERVAL
+        )
+
+    return app
 
 
 # =========================
 # RUN
 # =========================
 if __name__ == "__main__":
-    app.run_polling(drop_pending_updates=True)
+    app = build_app()
+
+    if Config.WEBHOOK_URL:
+        app.run_webhook(
+            listen=Config.WEBHOOK_LISTEN,
+            port=Config.WEBHOOK_PORT,
+            url_path=Config.WEBHOOK_PATH,
+            webhook_url=f"{Config.WEBHOOK_URL.rstrip('/')}/{Config.WEBHOOK_PATH}",
+            secret_token=Config.WEBHOOK_SECRET,
+            drop_pending_updates=True
+        )
+    else:
+        app.run_polling(drop_pending_updates=True)
@@ -0,0 +1,106 @@
+import asyncio
+import functools
+import inspect
+import time
+from collections import OrderedDict
+
+
+_MISSING = object()
+
+
+# =========================
+# BOUNDED LRU CACHE
+# =========================
+
+class LRUCache:
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key: (expires_at, value)
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+
+        if item is None:
+            return default
+
+        expires_at, value = item
+
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self):
+        self._data.clear()
+
+
+# =========================
+# ASYNC RESULT CACHE
+# =========================
+
+# Caches coroutine results for `ttl` seconds (or a {mode: seconds} mapping)
+# and coalesces concurrent identical calls into one in-flight query.
+
+def cached(ttl, maxsize=1024):
+
+    def decorator(func):
+        signature = inspect.signature(func)
+        results = LRUCache(maxsize)
+        inflight = {}
+
+        def ttl_for(arguments):
+            if isinstance(ttl, dict):
+                return ttl.get(arguments.get("mode"), ttl.get("default", 0))
+            return ttl
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = tuple(bound.arguments.items())
+
+            value = results.get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+
+            task = inflight.get(key)
+            if task is None:
+                task = asyncio.ensure_future(func(*args, **kwargs))
+                inflight[key] = task
+
+                def done(task, key=key, arguments=bound.arguments):
+                    inflight.pop(key, None)
+                    seconds = ttl_for(arguments)
+                    if seconds and not task.cancelled() and task.exception() is None:
+                        results.set(key, task.result(), ttl=seconds)
+
+                task.add_done_callback(done)
+
+            # One impatient caller must not cancel the query for the others
+            return await asyncio.shield(task)
+
+        wrapper.cache_clear = results.clear
+        return wrapper
+
+    return decorator
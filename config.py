@@ -12,6 +12,22 @@ class Config:
     BOT_USERNAME = os.getenv("BOT_USERNAME")
     UPDATES_CHANNEL = os.getenv("UPDATES_CHANNEL")
 
+    # Alternative Bot API server (e.g. a local or fake one)
+    BOT_API_URL = os.getenv("BOT_API_URL")
+
+    # =========================
+    # Update Serving
+    # =========================
+    # Webhook mode is used when WEBHOOK_URL is set, polling otherwise
+    WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+    WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+    WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+    WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "webhook")
+    WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+
+    # Updates handled at once, same-chat updates always keep their order
+    UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "32"))
+
     # =========================
     # Admin
     # =========================
@@ -31,6 +47,109 @@ class Config:
     # MongoDB
     # =========================
     MONGO_URI = os.getenv("MONGO_URI")
+    MONGO_DB = os.getenv("MONGO_DB", "chatfight")
+
+    MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+    MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+    MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "10000"))
+    MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "10000"))
+    MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "0"))  # 0 = no timeout
+
+    # Read preference for read-only stats queries (see database._READ_ROUTED),
+    # overridable per function: "get_top_groups=primary,get_global_user_count=nearest"
+    MONGO_READ_PREFERENCE = os.getenv("MONGO_READ_PREFERENCE", "secondaryPreferred")
+    MONGO_READ_ROUTING = os.getenv("MONGO_READ_ROUTING", "")
+    MONGO_MAX_STALENESS = int(os.getenv("MONGO_MAX_STALENESS", "90"))
+
+    # "background": the bot ensures indexes in a task after startup
+    # "off": run `python manage.py init-indexes` when deploying instead
+    MONGO_INDEX_BOOTSTRAP = os.getenv("MONGO_INDEX_BOOTSTRAP", "background")
+
+    # "daily": one document per user/group/day (default)
+    # "bucketed": one document per group/day with every member's count
+    STORAGE_MODE = os.getenv("STORAGE_MODE", "daily")
+    BUCKET_MAX_USERS = int(os.getenv("BUCKET_MAX_USERS", "1000"))
+
+    # =========================
+    # Message Counter Buffer
+    # =========================
+    FLUSH_INTERVAL_MS = int(os.getenv("FLUSH_INTERVAL_MS", "1000"))
+    FLUSH_MAX_ENTRIES = int(os.getenv("FLUSH_MAX_ENTRIES", "500"))
+
+    # Users/groups whose last written name is remembered
+    PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "50000"))
+    PROFILE_CACHE_TTL = int(os.getenv("PROFILE_CACHE_TTL", "3600"))
+
+    # Parallel Bot API get_chat calls for groups without a stored title
+    GET_CHAT_CONCURRENCY = int(os.getenv("GET_CHAT_CONCURRENCY", "5"))
+
+    # =========================
+    # Bulk Sending
+    # =========================
+    BOT_API_RATE = float(os.getenv("BOT_API_RATE", "25"))
+    BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", "100"))
+    BROADCAST_PROGRESS_INTERVAL = int(os.getenv("BROADCAST_PROGRESS_INTERVAL", "10"))
+
+    # =========================
+    # Quiz Events (interval 0 disables them)
+    # =========================
+    EVENT_INTERVAL = int(os.getenv("EVENT_INTERVAL", "0"))
+    EVENT_SPREAD = int(os.getenv("EVENT_SPREAD", "300"))
+    EVENT_TTL = int(os.getenv("EVENT_TTL", "600"))
+    EVENT_REFRESH_INTERVAL = int(os.getenv("EVENT_REFRESH_INTERVAL", "2"))
+
+    # =========================
+    # Leaderboard Engine
+    # =========================
+    LEADERBOARD_MAX_BOARDS = int(os.getenv("LEADERBOARD_MAX_BOARDS", "3000"))
+    LEADERBOARD_MAX_ENTRIES = int(os.getenv("LEADERBOARD_MAX_ENTRIES", "2000"))
+    LEADERBOARD_WARM_SIZE = int(os.getenv("LEADERBOARD_WARM_SIZE", "200"))
+    LEADERBOARD_WARM_GROUPS = int(os.getenv("LEADERBOARD_WARM_GROUPS", "50"))
+
+    # Pages of 10 reachable with the Prev/Next buttons
+    LEADERBOARD_MAX_PAGES = int(os.getenv("LEADERBOARD_MAX_PAGES", "10"))
+
+    # Global users/groups boards (turned off per worker in multi-process mode)
+    LEADERBOARD_GLOBAL_BOARDS = os.getenv("LEADERBOARD_GLOBAL_BOARDS", "1") == "1"
+
+    # Leaderboard button clicks: a burst on one message collapses into its
+    # last click, each chat gets CALLBACK_CHAT_RATE queries/s (burst size)
+    CALLBACK_DEBOUNCE_MS = int(os.getenv("CALLBACK_DEBOUNCE_MS", "400"))
+    CALLBACK_CHAT_RATE = float(os.getenv("CALLBACK_CHAT_RATE", "1"))
+    CALLBACK_CHAT_BURST = int(os.getenv("CALLBACK_CHAT_BURST", "5"))
+
+    # Leaderboard messages remembered to skip edits that change nothing
+    VIEW_CACHE_SIZE = int(os.getenv("VIEW_CACHE_SIZE", "10000"))
+
+    # Seconds between checks for newly closed days to roll into months
+    ROLLUP_INTERVAL = int(os.getenv("ROLLUP_INTERVAL", "3600"))
+
+    # Daily documents older than this many days are folded into the
+    # monthly rollups and deleted (0 keeps them forever)
+    RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "0"))
+
+    # Today/week boards only read daily documents, the week reaching back
+    # 7 days, so shorter horizons would undercount them
+    MIN_RETENTION_DAYS = 8
+
+    # =========================
+    # Multi-Process Runner
+    # =========================
+    WORKERS = int(os.getenv("WORKERS", "4"))
+
+    # =========================
+    # Query Result Cache (seconds per mode)
+    # =========================
+    CACHE_TTL_TODAY = int(os.getenv("CACHE_TTL_TODAY", "5"))
+    CACHE_TTL_WEEK = int(os.getenv("CACHE_TTL_WEEK", "30"))
+    CACHE_TTL_OVERALL = int(os.getenv("CACHE_TTL_OVERALL", "60"))
+    CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", "5000"))
+
+    # =========================
+    # Metrics (Prometheus text format, port 0 disables)
+    # =========================
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+    METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
 
     # =========================
     # Validation
@@ -48,3 +167,8 @@ class Config:
 
         if not Config.LOG_GROUP_ID:
             raise ValueError("LOG_GROUP_ID missing in .env")
+
+        if 0 < Config.RETENTION_DAYS < Config.MIN_RETENTION_DAYS:
+            raise ValueError(
+                f"RETENTION_DAYS must be 0 or at least {Config.MIN_RETENTION_DAYS}"
+            )
@@ -1,127 +1,1058 @@
-from pymongo import MongoClient, ASCENDING, DESCENDING
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+from pymongo.read_preferences import read_pref_mode_from_name, make_read_preference
+from cache import LRUCache, cached
 from config import Config
-from datetime import datetime, timedelta
-import pytz
+from datetime import date, datetime, timedelta
+from leaderboard import LeaderboardEngine
+from metrics import mongo_listeners
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
 
 # =========================
 # Mongo Connection
 # =========================
 
-client = MongoClient(Config.MONGO_URI)
-db = client["chatfight"]
+# One client per process, created on first use so importing this module
+# (and bot.py) does no network I/O
+_client = None
+
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = AsyncIOMotorClient(
+            Config.MONGO_URI,
+            maxPoolSize=Config.MONGO_MAX_POOL_SIZE,
+            minPoolSize=Config.MONGO_MIN_POOL_SIZE,
+            connectTimeoutMS=Config.MONGO_CONNECT_TIMEOUT_MS,
+            serverSelectionTimeoutMS=Config.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            socketTimeoutMS=Config.MONGO_SOCKET_TIMEOUT_MS,
+            event_listeners=mongo_listeners()
+        )
+    return _client
+
+
+def get_db():
+    return get_client()[Config.MONGO_DB]
+
+
+class _LazyCollection:
+
+    # Stands in for a motor collection until the client exists
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, attr):
+        return getattr(get_db()[self.name], attr)
+
+
+messages_col = _LazyCollection("messages")
+users_col = _LazyCollection("users")
+groups_col = _LazyCollection("groups")
+events_col = _LazyCollection("events")
+
+# Running per group+user totals, so "overall" is an indexed read
+totals_col = _LazyCollection("totals")
+
+# Optional storage layout: one document per group per day holding every
+# member's count (see Config.STORAGE_MODE)
+buckets_col = _LazyCollection("message_buckets")
+
+# Per user/group/month counts of closed days (see rollup_months)
+monthly_col = _LazyCollection("monthly_counts")
 
-messages_col = db["messages"]
-users_col = db["users"]
-groups_col = db["groups"]
-events_col = db["events"]
+# Checkpoints of resumable maintenance jobs
+migrations_col = _LazyCollection("migrations")
+
+broadcasts_col = _LazyCollection("broadcasts")
+
+# One open quiz per group, shared by every bot process
+active_events_col = _LazyCollection("active_events")
 
 # =========================
-# Indexes (Optimized)
+# READ ROUTING
 # =========================
 
-messages_col.create_index(
-    [("user_id", ASCENDING), ("group_id", ASCENDING), ("date", ASCENDING)],
-    unique=True
+# Read-only stats queries may be served by secondaries (bounded by
+# MONGO_MAX_STALENESS). Writes, event claims and the loads in-memory boards
+# are built from always stay on the primary.
+_READ_ROUTED = (
+    "get_leaderboard",
+    "get_global_leaderboard",
+    "get_top_groups",
+    "get_user_groups_stats",
+    "get_user_total_messages",
+    "get_total_group_messages",
+    "get_total_global_messages",
+    "get_global_user_count",
 )
 
-# Performance index for leaderboard sorting
-messages_col.create_index(
-    [("group_id", ASCENDING), ("date", ASCENDING)]
-)
 
-users_col.create_index("user_id", unique=True)
-groups_col.create_index("group_id", unique=True)
+def _load_read_routing():
+    routing = dict.fromkeys(_READ_ROUTED, Config.MONGO_READ_PREFERENCE)
 
-events_col.create_index(
-    [("user_id", ASCENDING), ("group_id", ASCENDING)],
-    unique=True
-)
+    # MONGO_READ_ROUTING="get_top_groups=primary,get_user_total_messages=nearest"
+    for item in filter(None, Config.MONGO_READ_ROUTING.split(",")):
+        name, _, mode = item.partition("=")
+        routing[name.strip()] = mode.strip()
+
+    preferences = {}
+    for name, mode in routing.items():
+        mode_id = read_pref_mode_from_name(mode)
+        if mode_id:
+            # Mongo rejects a staleness bound below 90 seconds
+            staleness = max(Config.MONGO_MAX_STALENESS, 90)
+            preferences[name] = make_read_preference(mode_id, None, staleness)
+
+    return preferences
+
+
+_read_preferences = _load_read_routing()
+
+
+def _reader(col, route):
+    # `route` is the public function name; unrouted reads and "primary"
+    # keep the client's default
+    preference = _read_preferences.get(route)
+    if preference is None:
+        return col
+    return col.with_options(read_preference=preference)
+
+# =========================
+# Indexes (Optimized)
+# =========================
+
+# Not run on import: `python manage.py init-indexes` or the bot's
+# background bootstrap (Config.MONGO_INDEX_BOOTSTRAP)
+async def create_indexes():
+
+    await messages_col.create_index(
+        [("user_id", ASCENDING), ("group_id", ASCENDING), ("date", ASCENDING)],
+        unique=True
+    )
+
+    # Performance index for leaderboard sorting
+    await messages_col.create_index(
+        [("group_id", ASCENDING), ("date", ASCENDING)]
+    )
+
+    # Date-only ranges: month rollups, the oldest-day lookup, global spans
+    await messages_col.create_index([("date", ASCENDING)])
+
+    await buckets_col.create_index(
+        [("group_id", ASCENDING), ("date", ASCENDING)]
+    )
+
+    await buckets_col.create_index([("date", ASCENDING)])
+
+    # Multikey, finds the buckets a user appears in
+    await buckets_col.create_index(
+        [("users", ASCENDING), ("date", ASCENDING)]
+    )
+
+    await totals_col.create_index(
+        [("group_id", ASCENDING), ("user_id", ASCENDING)],
+        unique=True
+    )
+
+    await totals_col.create_index(
+        [("group_id", ASCENDING), ("total", DESCENDING)]
+    )
+
+    # Unique key of the rollup $merge, also serves global month queries
+    await monthly_col.create_index(
+        [("month", ASCENDING), ("group_id", ASCENDING), ("user_id", ASCENDING)],
+        unique=True
+    )
+
+    await monthly_col.create_index(
+        [("group_id", ASCENDING), ("month", ASCENDING)]
+    )
+
+    await monthly_col.create_index(
+        [("user_id", ASCENDING), ("month", ASCENDING)]
+    )
+
+    await users_col.create_index("user_id", unique=True)
+    await groups_col.create_index("group_id", unique=True)
+
+    await events_col.create_index(
+        [("user_id", ASCENDING), ("group_id", ASCENDING)],
+        unique=True
+    )
+
+    await broadcasts_col.create_index("status")
+
+    await active_events_col.create_index("group_id", unique=True)
+    await active_events_col.create_index("expires_at", expireAfterSeconds=0)
 
 # =========================
 # IST DATE SYSTEM
 # =========================
 
+# Days are stored as integers: days since 1970-01-01 in IST. IST has no
+# DST, so a fixed offset is exact and the day only changes at midnight.
+
+IST_OFFSET = 5 * 3600 + 30 * 60
+DAY_SECONDS = 86400
+
+# Delay after midnight before a day counts as closed for rollups
+ROLLUP_GRACE = 300
+EPOCH = datetime(1970, 1, 1).date()
+
+_today = None
+_next_midnight = 0.0
+
+
 def _get_today():
-    india = pytz.timezone("Asia/Kolkata")
-    return datetime.now(india).strftime("%Y-%m-%d")
+    global _today, _next_midnight
+
+    now = time.time()
+
+    if now >= _next_midnight:
+        _today = int((now + IST_OFFSET) // DAY_SECONDS)
+        _next_midnight = (_today + 1) * DAY_SECONDS - IST_OFFSET
+
+    return _today
+
+
+def day_to_date(day: int):
+    return EPOCH + timedelta(days=day)
+
+
+def date_to_day(value):
+    # Accepts a date or a legacy "YYYY-MM-DD" string
+    if isinstance(value, str):
+        value = datetime.strptime(value, "%Y-%m-%d").date()
+    return (value - EPOCH).days
+
+
+def day_to_month(day: int):
+    # Months are numbered year * 12 + (month - 1)
+    value = day_to_date(day)
+    return value.year * 12 + value.month - 1
+
+
+def month_first_day(month: int):
+    year, index = divmod(month, 12)
+    return date_to_day(date(year, index + 1, 1))
+
+
+def _date_range(mode):
+
+    # (first_day, last_day), both inclusive, for modes served by the month
+    # planner. first_day is None for "overall". A custom range is a
+    # (start, end) tuple of days or dates.
+    today = _get_today()
+
+    if mode == "month":
+        return month_first_day(day_to_month(today)), today
+
+    if mode == "year":
+        return date_to_day(date(day_to_date(today).year, 1, 1)), today
+
+    if isinstance(mode, tuple):
+        start, end = (
+            value if isinstance(value, int) else date_to_day(value)
+            for value in mode
+        )
+        return start, min(end, today)
+
+    return None, today
 
 
 def _build_date_filter(mode):
 
     today = _get_today()
-    today_date = datetime.strptime(today, "%Y-%m-%d").date()
-    week_ago = (today_date - timedelta(days=7)).strftime("%Y-%m-%d")
 
     if mode == "today":
         return {"date": today}
 
     if mode == "week":
-        return {"date": {"$gte": week_ago}}
+        return {"date": {"$gte": today - 7}}
 
     return {}
 
+
+def _in_window(mode, day):
+
+    if mode == "today":
+        return day == _get_today()
+
+    if mode == "week":
+        return day >= _get_today() - 7
+
+    return True
+
 # =========================
-# MESSAGE COUNTER
+# DAILY COUNTS SOURCE
 # =========================
 
-def increment_message(user, chat):
+def _daily_source(match: dict, route=None):
 
-    today = _get_today()
+    # Returns (collection, stages) yielding {user_id, group_id, date, count}
+    # documents matching `match`, whatever the storage layout
+    if Config.STORAGE_MODE != "bucketed":
+        return _reader(messages_col, route), [{"$match": match}]
+
+    bucket_match = {k: v for k, v in match.items() if k != "user_id"}
+    if "user_id" in match:
+        bucket_match["users"] = match["user_id"]
 
-    messages_col.update_one(
+    stages = [
+        {"$match": bucket_match},
+        {"$project": {"group_id": 1, "date": 1, "counts": {"$objectToArray": "$counts"}}},
+        {"$unwind": "$counts"},
         {
-            "user_id": user.id,
-            "group_id": chat.id,
-            "date": today
+            "$project": {
+                "_id": 0,
+                "group_id": 1,
+                "date": 1,
+                "user_id": {"$toLong": "$counts.k"},
+                "count": "$counts.v"
+            }
+        }
+    ]
+
+    if "user_id" in match:
+        stages.append({"$match": {"user_id": match["user_id"]}})
+
+    return _reader(buckets_col, route), stages
+
+
+# =========================
+# MONTHLY ROLLUPS
+# =========================
+
+# Long windows (month, year, custom ranges, global "overall") read whole
+# months from monthly_col and only the remaining edge days from the daily
+# documents. A month is only read from the rollup once all of its days are
+# closed and rolled up.
+
+
+@cached(300)
+async def _rolled_through():
+    state = await migrations_col.find_one({"_id": "monthly"})
+    return state["through"] if state else None
+
+
+@cached(300)
+async def _compacted_before():
+    state = await migrations_col.find_one({"_id": "compaction"})
+    return state["before"] if state else None
+
+
+def _plan_range(first, last, rolled):
+
+    # Splits [first, last] into rolled-up months and (from, to) day spans
+    # left for the daily documents
+    months, spans = [], []
+
+    if rolled is not None:
+        last_month = day_to_month(rolled + 1) - 1
+
+        if first is None:
+            months = {"$lte": last_month}
+            first = month_first_day(last_month + 1)
+        else:
+            month = day_to_month(first)
+            if first != month_first_day(month):
+                month += 1
+
+            closes = min(last, rolled)
+            selected = []
+
+            while month_first_day(month + 1) - 1 <= closes:
+                selected.append(month)
+                month += 1
+
+            if selected:
+                start = month_first_day(selected[0])
+                end = month_first_day(selected[-1] + 1) - 1
+                months = {"$gte": selected[0], "$lte": selected[-1]}
+
+                if first < start:
+                    spans.append((first, start - 1))
+                first = end + 1
+
+    if first is None or first <= last:
+        spans.append((first, last))
+
+    return months, spans
+
+
+def _span_filter(spans):
+
+    filters = []
+    for first, last in spans:
+        bounds = {"$lte": last}
+        if first is not None:
+            bounds["$gte"] = first
+        filters.append({"date": bounds})
+
+    return filters[0] if len(filters) == 1 else {"$or": filters}
+
+
+async def _range_source(match: dict, mode, route=None):
+
+    first, last = _date_range(mode)
+
+    # Days before the retention horizon only survive as month totals, so
+    # ranges reaching into them are widened to whole months
+    compacted = await _compacted_before()
+    if compacted is not None:
+        if first is not None and first < compacted:
+            first = month_first_day(day_to_month(first))
+        if last < compacted:
+            last = month_first_day(day_to_month(last) + 1) - 1
+
+    months, spans = _plan_range(first, last, await _rolled_through())
+
+    daily = None
+    if spans:
+        daily = _daily_source({**match, **_span_filter(spans)}, route)
+
+    if not months:
+        # A range that is empty after clamping (e.g. starting after today)
+        # still gets a pipeline, one that matches nothing
+        return daily or _daily_source({**match, "date": {"$in": []}}, route)
+
+    stages = [
+        {"$match": {**match, "month": months}},
+        {"$project": {"_id": 0, "user_id": 1, "group_id": 1, "count": 1}}
+    ]
+
+    if daily:
+        col, daily_stages = daily
+        stages.append({"$unionWith": {"coll": col.name, "pipeline": daily_stages}})
+
+    return _reader(monthly_col, route), stages
+
+
+async def _window_source(match: dict, mode, route=None):
+
+    # (collection, stages) yielding {user_id, group_id, count} documents
+    # for any mode
+    if mode in ("today", "week"):
+        return _daily_source({**match, **_build_date_filter(mode)}, route)
+
+    return await _range_source(match, mode, route)
+
+
+async def _sum_messages(match: dict, mode, route=None):
+
+    # Buckets keep a running total, so per-group/global sums skip the unwind
+    if Config.STORAGE_MODE == "bucketed" and "user_id" not in match and mode in ("today", "week"):
+        stages = [{"$match": {**match, **_build_date_filter(mode)}}]
+        col, field = _reader(buckets_col, route), "$total"
+    else:
+        (col, stages), field = await _window_source(match, mode, route), "$count"
+
+    pipeline = stages + [{"$group": {"_id": None, "total": {"$sum": field}}}]
+
+    result = await col.aggregate(pipeline).to_list(None)
+    return result[0]["total"] if result else 0
+
+
+async def _rollup_month(month, last):
+
+    # Replaces the month's documents with its daily counts up to `last`
+    first = month_first_day(month)
+    col, stages = _daily_source({"date": {"$gte": first, "$lte": last}})
+
+    pipeline = stages + [
+        {
+            "$group": {
+                "_id": {"group_id": "$group_id", "user_id": "$user_id"},
+                "count": {"$sum": "$count"}
+            }
         },
         {
-            "$inc": {"count": 1},
-            "$setOnInsert": {
-                "user_id": user.id,
-                "group_id": chat.id,
-                "date": today
+            "$project": {
+                "_id": 0,
+                "month": {"$literal": month},
+                "group_id": "$_id.group_id",
+                "user_id": "$_id.user_id",
+                "count": 1
             }
         },
+        {
+            "$merge": {
+                "into": monthly_col.name,
+                "on": ["month", "group_id", "user_id"],
+                "whenMatched": "replace",
+                "whenNotMatched": "insert"
+            }
+        }
+    ]
+
+    await col.aggregate(pipeline).to_list(None)
+
+
+async def rollup_months():
+
+    # Rebuilds the month documents of every month with days closed since
+    # the last run, from that month's daily documents. Whole months are
+    # recomputed and replaced, so a rerun after a crash is harmless.
+    # Returns the number of months rebuilt.
+    state = await migrations_col.find_one({"_id": "monthly"}) or {}
+
+    # Days close a few minutes after midnight, once the write-behind buffer
+    # has flushed their last counts
+    closed = int((time.time() - ROLLUP_GRACE + IST_OFFSET) // DAY_SECONDS) - 1
+
+    if "through" in state:
+        start = state["through"] + 1
+    else:
+        col, stages = _daily_source({})
+        oldest = await col.aggregate(
+            stages + [{"$sort": {"date": 1}}, {"$limit": 1}]
+        ).to_list(None)
+        start = oldest[0]["date"] if oldest else closed + 1
+
+    rebuilt = 0
+
+    for month in range(day_to_month(start), day_to_month(closed) + 1):
+        last = min(month_first_day(month + 1) - 1, closed)
+
+        await _rollup_month(month, last)
+        await migrations_col.update_one(
+            {"_id": "monthly"},
+            {"$set": {"through": last}},
+            upsert=True
+        )
+        rebuilt += 1
+
+    if start > closed and "through" not in state:
+        await migrations_col.update_one(
+            {"_id": "monthly"},
+            {"$set": {"through": closed}},
+            upsert=True
+        )
+
+    _rolled_through.cache_clear()
+    return rebuilt
+
+# =========================
+# MESSAGE COUNTER (WRITE-BEHIND)
+# =========================
+
+# Increments are coalesced in memory and written with one unordered
+# bulk_write per collection by flush_pending_messages().
+
+_pending_counts = {}   # (user_id, group_id, date): count
+_pending_totals = {}   # (user_id, group_id): count
+_pending_users = {}    # user_id: (full_name, username)
+_pending_groups = {}   # group_id: title
+
+# Last profile written per user/group, so unchanged names are not rewritten
+_user_profiles = LRUCache(Config.PROFILE_CACHE_SIZE, Config.PROFILE_CACHE_TTL)
+_group_profiles = LRUCache(Config.PROFILE_CACHE_SIZE, Config.PROFILE_CACHE_TTL)
+
+# Held while flushing. Board loads don't take it, they check _flushes (bumped
+# by every flush that writes counts) to tell whether one ran meanwhile.
+_flush_lock = asyncio.Lock()
+_flushes = 0
+
+
+async def increment_message(user, chat):
+
+    today = _get_today()
+
+    key = (user.id, chat.id, today)
+    _pending_counts[key] = _pending_counts.get(key, 0) + 1
+
+    _boards.add(user.id, chat.id, today)
+
+    key = (user.id, chat.id)
+    _pending_totals[key] = _pending_totals.get(key, 0) + 1
+
+    profile = (user.full_name or "User", user.username or "")
+    if _user_profiles.get(user.id) != profile:
+        _pending_users[user.id] = profile
+
+    title = chat.title or "Group"
+    if _group_profiles.get(chat.id) != title:
+        _pending_groups[chat.id] = title
+
+    if len(_pending_counts) >= Config.FLUSH_MAX_ENTRIES and not _flush_lock.locked():
+        await flush_pending_messages()
+
+
+def _requeue(pending, counts):
+    for key, count in counts.items():
+        pending[key] = pending.get(key, 0) + count
+
+
+def _requeue_counts(counts):
+    _requeue(_pending_counts, counts)
+
+
+def _requeue_totals(counts):
+    _requeue(_pending_totals, counts)
+
+
+def _daily_op(key, count):
+    user_id, group_id, day = key
+    return UpdateOne(
+        {"user_id": user_id, "group_id": group_id, "date": day},
+        {"$inc": {"count": count}},
         upsert=True
     )
 
-    users_col.update_one(
-        {"user_id": user.id},
-        {
+
+def _bucket_filter(user_id, group_id, day):
+    # The bucket already holding the user, else any bucket with room, else
+    # (upserted) a new overflow bucket. A concurrent spill can leave a user
+    # in two buckets, readers sum them so totals stay exact.
+    return {
+        "group_id": group_id,
+        "date": day,
+        "$or": [
+            {"users": user_id},
+            {f"users.{Config.BUCKET_MAX_USERS - 1}": {"$exists": False}}
+        ]
+    }
+
+
+def _bucket_op(key, count):
+    user_id, group_id, day = key
+    field = f"counts.{user_id}"
+
+    return UpdateOne(
+        _bucket_filter(user_id, group_id, day),
+        [{
             "$set": {
-                "full_name": user.full_name or "User",
-                "username": user.username or ""
+                "users": {"$setUnion": [{"$ifNull": ["$users", []]}, [user_id]]},
+                field: {"$add": [{"$ifNull": [f"${field}", 0]}, count]},
+                "total": {"$add": [{"$ifNull": ["$total", 0]}, count]}
             }
-        },
+        }],
         upsert=True
     )
 
-    groups_col.update_one(
-        {"group_id": chat.id},
-        {
-            "$set": {"title": chat.title or "Group"}
-        },
+
+def _bucket_copy_op(key, count):
+    user_id, group_id, day = key
+    field = f"counts.{user_id}"
+
+    # Sets the user's count instead of adding to it (the total moves by the
+    # difference), so copying the same daily document twice changes nothing
+    return UpdateOne(
+        _bucket_filter(user_id, group_id, day),
+        [{
+            "$set": {
+                "users": {"$setUnion": [{"$ifNull": ["$users", []]}, [user_id]]},
+                "total": {"$add": [
+                    {"$ifNull": ["$total", 0]},
+                    {"$subtract": [count, {"$ifNull": [f"${field}", 0]}]}
+                ]},
+                field: count
+            }
+        }],
         upsert=True
     )
 
+
+def _total_op(key, count):
+    user_id, group_id = key
+    return UpdateOne(
+        {"user_id": user_id, "group_id": group_id},
+        {"$inc": {"total": count}},
+        upsert=True
+    )
+
+
+def _message_writer():
+    if Config.STORAGE_MODE == "bucketed":
+        return buckets_col, _bucket_op
+    return messages_col, _daily_op
+
+
+async def _flush_counts(col, counts, build_op, requeue):
+
+    if not counts:
+        return
+
+    keys = list(counts)
+    ops = [build_op(key, counts[key]) for key in keys]
+
+    try:
+        await col.bulk_write(ops, ordered=False)
+    except BulkWriteError as e:
+        # Only the failed upserts are retried, the rest already landed
+        failed = [keys[err["index"]] for err in e.details["writeErrors"]]
+        requeue({key: counts[key] for key in failed})
+        logger.warning("%s flush: %d upserts failed", col.name, len(failed))
+    except PyMongoError:
+        requeue(counts)
+        logger.exception("%s flush failed, %d keys requeued", col.name, len(keys))
+
+
+async def write_message_counts(counts: dict):
+
+    # Writes {(user_id, group_id, day): count} straight to the active
+    # storage layout and the totals rollup, bypassing the buffer (backfills,
+    # benchmarks)
+    if not counts:
+        return
+
+    totals = {}
+    for (user_id, group_id, _), count in counts.items():
+        totals[(user_id, group_id)] = totals.get((user_id, group_id), 0) + count
+
+    col, build_op = _message_writer()
+    await col.bulk_write(
+        [build_op(key, count) for key, count in counts.items()],
+        ordered=False
+    )
+    await totals_col.bulk_write(
+        [_total_op(key, count) for key, count in totals.items()],
+        ordered=False
+    )
+
+
+async def flush_pending_messages():
+    async with _flush_lock:
+        await _flush_pending()
+
+
+async def _flush_pending():
+    global _pending_counts, _pending_totals, _pending_users, _pending_groups, _flushes
+
+    counts, totals = _pending_counts, _pending_totals
+    users, groups = _pending_users, _pending_groups
+    _pending_counts, _pending_totals = {}, {}
+    _pending_users, _pending_groups = {}, {}
+
+    if counts or totals:
+        _flushes += 1
+
+    col, build_op = _message_writer()
+    await _flush_counts(col, counts, build_op, _requeue_counts)
+    await _flush_counts(totals_col, totals, _total_op, _requeue_totals)
+
+    # Profiles are only cached once written, so a failed flush is simply
+    # retried on the next message
+    if users:
+        try:
+            await users_col.bulk_write([
+                UpdateOne(
+                    {"user_id": user_id},
+                    {"$set": {"full_name": full_name, "username": username}},
+                    upsert=True
+                )
+                for user_id, (full_name, username) in users.items()
+            ], ordered=False)
+        except PyMongoError:
+            logger.exception("User profile flush failed")
+        else:
+            for user_id, profile in users.items():
+                _user_profiles.set(user_id, profile)
+
+    if groups:
+        try:
+            await groups_col.bulk_write([
+                UpdateOne(
+                    {"group_id": group_id},
+                    {"$set": {"title": title}},
+                    upsert=True
+                )
+                for group_id, title in groups.items()
+            ], ordered=False)
+        except PyMongoError:
+            logger.exception("Group profile flush failed")
+        else:
+            for group_id, title in groups.items():
+                _group_profiles.set(group_id, title)
+
+# =========================
+# RESULT CACHE
+# =========================
+
+# Totals and per-user stats are not kept by the engine, so identical
+# requests within a short window share one query
+_RESULT_TTL = {
+    "today": Config.CACHE_TTL_TODAY,
+    "week": Config.CACHE_TTL_WEEK,
+    "overall": Config.CACHE_TTL_OVERALL,
+    "month": Config.CACHE_TTL_WEEK,
+    "year": Config.CACHE_TTL_OVERALL,
+    "default": Config.CACHE_TTL_OVERALL,  # custom ranges
+}
+
+
+def result_ttl(mode):
+    # How stale a cached total for `mode` may be
+    return _RESULT_TTL.get(mode, _RESULT_TTL["default"])
+
+# =========================
+# LEADERBOARD ENGINE
+# =========================
+
+# Top lists for groups, global users and global groups are answered from
+# in-memory boards, fed by increment_message and loaded from Mongo on miss
+
+_boards = LeaderboardEngine(
+    Config.LEADERBOARD_MAX_BOARDS,
+    Config.LEADERBOARD_MAX_ENTRIES
+)
+
+# One load at a time per board: (scope, mode): [lock, users]
+_board_locks = {}
+
+# Loads retried when a flush overlaps them before serving unkept rows
+BOARD_LOAD_ATTEMPTS = 3
+
+
+def _scope_member(scope, user_id, group_id):
+
+    if scope == "users":
+        return user_id
+
+    if scope == "groups":
+        return group_id
+
+    return user_id if scope[1] == group_id else None
+
+
+@cached(_RESULT_TTL, maxsize=Config.CACHE_MAX_SIZE)
+async def _query_top(scope, mode, limit):
+
+    if scope == "users":
+        return await _query_global_leaderboard(mode, limit, "get_global_leaderboard")
+
+    if scope == "groups":
+        return await _query_top_groups(mode, limit, "get_top_groups")
+
+    return await _query_leaderboard(scope[1], mode, limit, "get_leaderboard")
+
+
+async def _board_top(scope, mode, query, limit=10):
+
+    # A worker only sees increments for its own chats, so global lists come
+    # from Mongo when updates are split across processes. Month, year and
+    # custom ranges have no boards.
+    if scope in ("users", "groups") and not Config.LEADERBOARD_GLOBAL_BOARDS:
+        return await _query_top(scope, mode, limit)
+
+    if mode not in LeaderboardEngine.MODES:
+        return await _query_top(scope, mode, limit)
+
+    today = _get_today()
+    board = _boards.get(scope, mode, today)
+    rows = board.top(limit) if board else None
+
+    if rows is not None:
+        return rows
+
+    entry = _board_locks.setdefault((scope, mode), [asyncio.Lock(), 0])
+    entry[1] += 1
+
+    try:
+        async with entry[0]:
+            # Another request may have loaded it while we waited
+            board = _boards.get(scope, mode, today)
+            rows = board.top(limit) if board else None
+
+            if rows is not None:
+                return rows
+
+            rows, loaded = await _load_board(scope, mode, query, limit, today)
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del _board_locks[(scope, mode)]
+
+    return rows if rows is not None else loaded[:limit]
+
+
+async def _load_board(scope, mode, query, limit, today):
+
+    # Counts still in the write-behind buffer are not in Mongo yet and are
+    # added on top of the query. A flush running during the query leaves it
+    # unknown whether its counts made it into the result, then the load is
+    # retried, and finally served without keeping the board.
+    size = max(Config.LEADERBOARD_WARM_SIZE, limit)
+
+    for attempt in range(BOARD_LOAD_ATTEMPTS):
+        flushing, flushes = _flush_lock.locked(), _flushes
+        loaded = await query(size)
+        exact = not flushing and flushes == _flushes
+
+        if exact or attempt == BOARD_LOAD_ATTEMPTS - 1:
+            break
+
+    if exact:
+        board = _boards.load(scope, mode, loaded, len(loaded) < size, today)
+    else:
+        board = _boards.build(loaded, len(loaded) < size, today)
+
+    for (user_id, group_id, day), count in _pending_counts.items():
+        member_id = _scope_member(scope, user_id, group_id)
+        if member_id is not None and _in_window(mode, day):
+            board.add(member_id, count)
+
+    return board.top(limit), loaded
+
+
+def board_stamp(scope, mode):
+
+    # Changes whenever the board's rows may have changed. None when the
+    # board is not in memory, so callers can't tell and must query.
+    if scope in ("users", "groups") and not Config.LEADERBOARD_GLOBAL_BOARDS:
+        return None
+
+    board = _boards.get(scope, mode, _get_today())
+    return (board.generation, board.version) if board else None
+
+
+async def warm_leaderboards(owns_chat=None):
+
+    if Config.LEADERBOARD_GLOBAL_BOARDS:
+        for mode in LeaderboardEngine.MODES:
+            await get_global_leaderboard(mode)
+            await get_top_groups(mode)
+
+    active = await _query_top_groups("today", Config.LEADERBOARD_WARM_GROUPS)
+
+    for group_id, _ in active:
+        if owns_chat and not owns_chat(group_id):
+            continue
+
+        for mode in LeaderboardEngine.MODES:
+            await get_leaderboard(group_id, mode)
+
 # =========================
 # USER / GROUP INFO
 # =========================
 
-def get_user_info(user_id: int):
-    return users_col.find_one({"user_id": user_id})
+async def get_user_info(user_id: int):
+    return await users_col.find_one({"user_id": user_id})
+
+
+async def get_users_info(user_ids):
+
+    # Names we wrote or read recently come from the profile cache, the rest
+    # from one $in query
+    users = {}
+    missing = []
+
+    for user_id in user_ids:
+        profile = _user_profiles.get(user_id)
+        if profile is None:
+            missing.append(user_id)
+        else:
+            users[user_id] = {"full_name": profile[0], "username": profile[1]}
+
+    if missing:
+        cursor = users_col.find(
+            {"user_id": {"$in": missing}},
+            {"_id": 0, "user_id": 1, "full_name": 1, "username": 1}
+        )
+
+        async for doc in cursor:
+            profile = (doc.get("full_name", "User"), doc.get("username", ""))
+            _user_profiles.set(doc["user_id"], profile)
+            users[doc["user_id"]] = doc
+
+    return users
+
+
+async def get_group_info(group_id: int):
+    return await groups_col.find_one({"group_id": group_id})
+
+
+async def get_group_titles(group_ids):
+
+    titles = {}
+    missing = []
+
+    for group_id in group_ids:
+        title = _group_profiles.get(group_id)
+        if title is None:
+            missing.append(group_id)
+        else:
+            titles[group_id] = title
+
+    if missing:
+        cursor = groups_col.find(
+            {"group_id": {"$in": missing}, "title": {"$exists": True}},
+            {"_id": 0, "group_id": 1, "title": 1}
+        )
+
+        async for doc in cursor:
+            _group_profiles.set(doc["group_id"], doc["title"])
+            titles[doc["group_id"]] = doc["title"]
+
+    return titles
+
 
+async def save_group_titles(titles):
 
-def get_group_info(group_id: int):
-    return groups_col.find_one({"group_id": group_id})
+    if not titles:
+        return
+
+    await groups_col.bulk_write([
+        UpdateOne({"group_id": group_id}, {"$set": {"title": title}}, upsert=True)
+        for group_id, title in titles.items()
+    ], ordered=False)
+
+    for group_id, title in titles.items():
+        _group_profiles.set(group_id, title)
 
 # =========================
 # EVENT BONUS SYSTEM
 # =========================
 
-def add_bonus_points(user_id: int, group_id: int, points: int):
+async def iter_group_ids():
+    cursor = groups_col.find({}, {"_id": 0, "group_id": 1})
+    async for doc in cursor:
+        yield doc["group_id"]
+
+
+async def start_event(group_id: int, answer: int, ttl: int):
+
+    await active_events_col.replace_one(
+        {"group_id": group_id},
+        {
+            "group_id": group_id,
+            "answer": answer,
+            "expires_at": datetime.utcnow() + timedelta(seconds=ttl)
+        },
+        upsert=True
+    )
+
+
+@cached(Config.EVENT_REFRESH_INTERVAL)
+async def get_active_event_groups():
+
+    cursor = active_events_col.find(
+        {"expires_at": {"$gt": datetime.utcnow()}},
+        {"_id": 0, "group_id": 1}
+    )
+    return frozenset([doc["group_id"] async for doc in cursor])
+
+
+async def claim_event(group_id: int, answer: int):
+
+    # Deleting on match makes the first correct answer the only winner,
+    # whichever process sees it
+    return await active_events_col.find_one_and_delete({
+        "group_id": group_id,
+        "answer": answer,
+        "expires_at": {"$gt": datetime.utcnow()}
+    })
+
 
-    events_col.update_one(
+async def add_bonus_points(user_id: int, group_id: int, points: int):
+
+    await events_col.update_one(
         {
             "user_id": user_id,
             "group_id": group_id
@@ -133,9 +1064,9 @@ def add_bonus_points(user_id: int, group_id: int, points: int):
     )
 
 
-def get_event_points(user_id: int, group_id: int):
+async def get_event_points(user_id: int, group_id: int):
 
-    data = events_col.find_one(
+    data = await events_col.find_one(
         {"user_id": user_id, "group_id": group_id}
     )
     return data["points"] if data and "points" in data else 0
@@ -144,13 +1075,28 @@ def get_event_points(user_id: int, group_id: int):
 # GROUP LEADERBOARD
 # =========================
 
-def get_leaderboard(group_id: int, mode="overall"):
+async def get_leaderboard(group_id: int, mode="overall", limit=10, offset=0):
+    rows = await _board_top(
+        ("group", group_id), mode,
+        lambda size: _query_leaderboard(group_id, mode, size),
+        offset + limit
+    )
+    return rows[offset:]
+
 
-    match_stage = {"group_id": group_id}
-    match_stage.update(_build_date_filter(mode))
+async def _query_leaderboard(group_id, mode, limit, route=None):
 
-    pipeline = [
-        {"$match": match_stage},
+    if mode == "overall":
+        cursor = _reader(totals_col, route).find(
+            {"group_id": group_id},
+            {"_id": 0, "user_id": 1, "total": 1}
+        ).sort("total", DESCENDING).limit(limit)
+
+        return [(r["user_id"], r["total"]) async for r in cursor]
+
+    col, stages = await _window_source({"group_id": group_id}, mode, route)
+
+    pipeline = stages + [
         {
             "$group": {
                 "_id": "$user_id",
@@ -158,22 +1104,50 @@ def get_leaderboard(group_id: int, mode="overall"):
             }
         },
         {"$sort": {"total": -1}},
-        {"$limit": 10}
+        {"$limit": limit}
     ]
 
-    results = list(messages_col.aggregate(pipeline))
+    results = await col.aggregate(pipeline).to_list(None)
     return [(r["_id"], r["total"]) for r in results]
 
+# =========================
+# GROUP RANK
+# =========================
+
+async def get_user_rank(user_id: int, group_id: int):
+
+    # Overall position in a group as (rank, total), or None without
+    # messages. Both reads use the (group_id, total) index, no sorting.
+    mine = await totals_col.find_one(
+        {"group_id": group_id, "user_id": user_id},
+        {"_id": 0, "total": 1}
+    )
+    if not mine:
+        return None
+
+    ahead = await totals_col.count_documents(
+        {"group_id": group_id, "total": {"$gt": mine["total"]}}
+    )
+    return ahead + 1, mine["total"]
+
 # =========================
 # GLOBAL LEADERBOARD
 # =========================
 
-def get_global_leaderboard(mode="overall"):
+async def get_global_leaderboard(mode="overall", limit=10, offset=0):
+    rows = await _board_top(
+        "users", mode,
+        lambda size: _query_global_leaderboard(mode, size),
+        offset + limit
+    )
+    return rows[offset:]
 
-    match_stage = _build_date_filter(mode)
 
-    pipeline = [
-        {"$match": match_stage},
+async def _query_global_leaderboard(mode, limit, route=None):
+
+    col, stages = await _window_source({}, mode, route)
+
+    pipeline = stages + [
         {
             "$group": {
                 "_id": "$user_id",
@@ -181,23 +1155,24 @@ def get_global_leaderboard(mode="overall"):
             }
         },
         {"$sort": {"total": -1}},
-        {"$limit": 10}
+        {"$limit": limit}
     ]
 
-    results = list(messages_col.aggregate(pipeline))
+    results = await col.aggregate(pipeline).to_list(None)
     return [(r["_id"], r["total"]) for r in results]
 
 # =========================
 # USER GROUP STATS
 # =========================
 
-def get_user_groups_stats(user_id: int, mode="overall"):
+@cached(_RESULT_TTL, maxsize=Config.CACHE_MAX_SIZE)
+async def get_user_groups_stats(user_id: int, mode="overall"):
 
-    match_stage = {"user_id": user_id}
-    match_stage.update(_build_date_filter(mode))
+    col, stages = await _window_source(
+        {"user_id": user_id}, mode, "get_user_groups_stats"
+    )
 
-    pipeline = [
-        {"$match": match_stage},
+    pipeline = stages + [
         {
             "$group": {
                 "_id": "$group_id",
@@ -208,41 +1183,36 @@ def get_user_groups_stats(user_id: int, mode="overall"):
         {"$limit": 10}
     ]
 
-    results = list(messages_col.aggregate(pipeline))
+    results = await col.aggregate(pipeline).to_list(None)
     return [(r["_id"], r["total"]) for r in results]
 
 # =========================
 # USER GLOBAL TOTALS (ALL GROUPS)
 # =========================
 
-def get_user_total_messages(user_id: int, mode="overall"):
-
-    match_stage = {"user_id": user_id}
-    match_stage.update(_build_date_filter(mode))
-
-    pipeline = [
-        {"$match": match_stage},
-        {
-            "$group": {
-                "_id": None,
-                "total": {"$sum": "$count"}
-            }
-        }
-    ]
+@cached(_RESULT_TTL, maxsize=Config.CACHE_MAX_SIZE)
+async def get_user_total_messages(user_id: int, mode="overall"):
 
-    result = list(messages_col.aggregate(pipeline))
-    return result[0]["total"] if result else 0
+    return await _sum_messages({"user_id": user_id}, mode, "get_user_total_messages")
 
 # =========================
 # TOP GROUPS
 # =========================
 
-def get_top_groups(mode="overall"):
+async def get_top_groups(mode="overall", limit=10, offset=0):
+    rows = await _board_top(
+        "groups", mode,
+        lambda size: _query_top_groups(mode, size),
+        offset + limit
+    )
+    return rows[offset:]
+
+
+async def _query_top_groups(mode, limit, route=None):
 
-    match_stage = _build_date_filter(mode)
+    col, stages = await _window_source({}, mode, route)
 
-    pipeline = [
-        {"$match": match_stage},
+    pipeline = stages + [
         {
             "$group": {
                 "_id": "$group_id",
@@ -250,58 +1220,394 @@ def get_top_groups(mode="overall"):
             }
         },
         {"$sort": {"total": -1}},
-        {"$limit": 10}
+        {"$limit": limit}
     ]
 
-    results = list(messages_col.aggregate(pipeline))
+    results = await col.aggregate(pipeline).to_list(None)
     return [(r["_id"], r["total"]) for r in results]
 
 # =========================
 # TOTAL GROUP MESSAGES
 # =========================
 
-def get_total_group_messages(group_id: int, mode="overall"):
+@cached(_RESULT_TTL, maxsize=Config.CACHE_MAX_SIZE)
+async def get_total_group_messages(group_id: int, mode="overall"):
 
-    match_stage = {"group_id": group_id}
-    match_stage.update(_build_date_filter(mode))
+    if mode == "overall":
+        pipeline = [
+            {"$match": {"group_id": group_id}},
+            {"$group": {"_id": None, "total": {"$sum": "$total"}}}
+        ]
 
-    pipeline = [
-        {"$match": match_stage},
-        {
-            "$group": {
-                "_id": None,
-                "total": {"$sum": "$count"}
-            }
-        }
-    ]
+        col = _reader(totals_col, "get_total_group_messages")
+        result = await col.aggregate(pipeline).to_list(None)
+        return result[0]["total"] if result else 0
 
-    result = list(messages_col.aggregate(pipeline))
-    return result[0]["total"] if result else 0
+    return await _sum_messages({"group_id": group_id}, mode, "get_total_group_messages")
 
 # =========================
 # TOTAL GLOBAL MESSAGES
 # =========================
 
-def get_total_global_messages(mode="overall"):
+@cached(_RESULT_TTL, maxsize=Config.CACHE_MAX_SIZE)
+async def get_total_global_messages(mode="overall"):
+
+    return await _sum_messages({}, mode, "get_total_global_messages")
+
+# =========================
+# GLOBAL USER COUNT
+# =========================
+
+async def get_global_user_count():
+    return await _reader(users_col, "get_global_user_count").count_documents({})
+
+# =========================
+# ROLLUP MAINTENANCE
+# =========================
+
+async def rebuild_totals():
 
-    match_stage = _build_date_filter(mode)
+    # Recomputes totals_col from the month rollups and daily documents.
+    # Run with the bot stopped, increments made during the rebuild would be
+    # lost.
+    col, stages = await _window_source({}, "overall")
 
-    pipeline = [
-        {"$match": match_stage},
+    pipeline = stages + [
         {
             "$group": {
-                "_id": None,
+                "_id": {"group_id": "$group_id", "user_id": "$user_id"},
                 "total": {"$sum": "$count"}
             }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "group_id": "$_id.group_id",
+                "user_id": "$_id.user_id",
+                "total": 1
+            }
+        },
+        {
+            "$merge": {
+                "into": totals_col.name,
+                "on": ["group_id", "user_id"],
+                "whenMatched": "replace",
+                "whenNotMatched": "insert"
+            }
         }
     ]
 
-    result = list(messages_col.aggregate(pipeline))
-    return result[0]["total"] if result else 0
+    await col.aggregate(pipeline).to_list(None)
+    return await totals_col.count_documents({})
 
 # =========================
-# GLOBAL USER COUNT
+# BROADCAST JOBS
+# =========================
+
+# Targets are walked in id order from users_col then groups_col, so a job
+# only needs (phase, last_id) to resume where it stopped
+BROADCAST_PHASES = (
+    ("users", users_col, "user_id"),
+    ("groups", groups_col, "group_id"),
+)
+
+
+async def create_broadcast(job: dict):
+    job.update({
+        "status": "running",
+        "phase": BROADCAST_PHASES[0][0],
+        "last_id": None,
+        "sent": 0,
+        "failed": 0,
+        "total": await count_broadcast_targets(),
+        "created_at": datetime.utcnow()
+    })
+
+    result = await broadcasts_col.insert_one(job)
+    job["_id"] = result.inserted_id
+    return job
+
+
+async def update_broadcast(job_id, fields: dict):
+    await broadcasts_col.update_one({"_id": job_id}, {"$set": fields})
+
+
+async def get_running_broadcasts():
+    return await broadcasts_col.find({"status": "running"}).to_list(None)
+
+
+async def count_broadcast_targets():
+    total = 0
+    for _, col, _ in BROADCAST_PHASES:
+        total += await col.estimated_document_count()
+    return total
+
+
+async def iter_broadcast_targets(phase, last_id, batch_size):
+
+    # Yields (phase, batch of chat ids) from the resume point onwards
+    started = False
+
+    for name, col, field in BROADCAST_PHASES:
+        if name == phase:
+            started = True
+        if not started:
+            continue
+
+        query = {field: {"$gt": last_id}} if name == phase and last_id is not None else {}
+        cursor = col.find(query, {"_id": 0, field: 1}).sort(field, ASCENDING)
+
+        batch = []
+        async for doc in cursor:
+            batch.append(doc[field])
+            if len(batch) >= batch_size:
+                yield name, batch
+                batch = []
+
+        if batch:
+            yield name, batch
+
+# =========================
+# DAY KEY MIGRATION
+# =========================
+
+async def migrate_day_keys(batch_size=1000, pause=0.1):
+
+    # Rewrites legacy "YYYY-MM-DD" dates to integer days in _id order, so it
+    # can run while the bot is online and be resumed at any point.
+    # Returns (converted, merged).
+    converted = merged = 0
+    last_id = None
+
+    while True:
+        query = {"date": {"$type": "string"}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+
+        docs = await messages_col.find(
+            query, {"date": 1, "user_id": 1, "group_id": 1, "count": 1}
+        ).sort("_id", ASCENDING).limit(batch_size).to_list(None)
+
+        if not docs:
+            return converted, merged
+
+        last_id = docs[-1]["_id"]
+
+        ops = [
+            UpdateOne(
+                {"_id": doc["_id"], "date": doc["date"]},
+                {"$set": {"date": date_to_day(doc["date"])}}
+            )
+            for doc in docs
+        ]
+
+        conflicts = []
+
+        try:
+            result = await messages_col.bulk_write(ops, ordered=False)
+            converted += result.modified_count
+        except BulkWriteError as e:
+            converted += e.details["nModified"]
+            for err in e.details["writeErrors"]:
+                if err["code"] != 11000:
+                    raise
+                conflicts.append(docs[err["index"]])
+
+        # The bot already wrote an integer-day document for the same
+        # user/group/day, fold the legacy count into it
+        for doc in conflicts:
+            await messages_col.update_one(
+                {
+                    "user_id": doc["user_id"],
+                    "group_id": doc["group_id"],
+                    "date": date_to_day(doc["date"])
+                },
+                {"$inc": {"count": doc.get("count", 0)}}
+            )
+            await messages_col.delete_one({"_id": doc["_id"], "date": doc["date"]})
+            merged += 1
+
+        if pause:
+            await asyncio.sleep(pause)
+
+# =========================
+# BUCKET MIGRATION
+# =========================
+
+async def migrate_to_buckets(batch_size=1000, pause=0.1):
+
+    # Copies daily documents into group/day buckets, checkpointing the last
+    # _id after every batch so an interrupted run resumes where it stopped.
+    # Copies set counts rather than add them, so a batch replayed after a
+    # crash or a partial bulk write error is not counted twice.
+    # Run with the bot stopped, then switch STORAGE_MODE to "bucketed".
+    state = await migrations_col.find_one({"_id": "buckets"}) or {}
+    last_id = state.get("last_id")
+    moved = 0
+
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+
+        docs = await messages_col.find(
+            query, {"user_id": 1, "group_id": 1, "date": 1, "count": 1}
+        ).sort("_id", ASCENDING).limit(batch_size).to_list(None)
+
+        if not docs:
+            return moved
+
+        await buckets_col.bulk_write([
+            _bucket_copy_op(
+                (doc["user_id"], doc["group_id"], date_to_day(doc["date"])
+                 if isinstance(doc["date"], str) else doc["date"]),
+                doc.get("count", 0)
+            )
+            for doc in docs
+        ], ordered=False)
+
+        last_id = docs[-1]["_id"]
+        moved += len(docs)
+
+        await migrations_col.update_one(
+            {"_id": "buckets"},
+            {"$set": {"last_id": last_id}},
+            upsert=True
+        )
+
+        if pause:
+            await asyncio.sleep(pause)
+
 # =========================
+# DAILY COMPACTION
+# =========================
+
+async def _group_sums(col, stages):
+    result = await col.aggregate(stages + [
+        {"$group": {"_id": "$group_id", "total": {"$sum": "$count"}}}
+    ]).to_list(None)
+    return {doc["_id"]: doc["total"] for doc in result}
+
+
+async def _range_sum(first, last):
+    # What the readers report for [first, last]
+    col, stages = await _window_source({}, (first, last))
+    return sum((await _group_sums(col, stages)).values())
+
+
+async def _delete_days(col, first, last, batch_size, pause):
+
+    # Per group, so every batch is an index range on (group_id, date)
+    deleted = 0
+    span = {"date": {"$gte": first, "$lte": last}}
+
+    for group_id in await col.distinct("group_id", span):
+        while True:
+            docs = await col.find(
+                {"group_id": group_id, **span}, {"_id": 1}
+            ).limit(batch_size).to_list(None)
+
+            if not docs:
+                break
+
+            result = await col.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+            deleted += result.deleted_count
+
+            if pause:
+                await asyncio.sleep(pause)
+
+    return deleted
+
+
+async def compact_daily(horizon_days, batch_size=1000, pause=0.1, verify_only=False):
+
+    # Deletes daily documents of whole months older than `horizon_days`
+    # once their month rollup is verified to hold the same per-group sums.
+    # Those months then live on in monthly_col only; overall totals read the
+    # rollups, so they are identical before and after. Safe online and
+    # resumable. With verify_only nothing is changed and mismatching months
+    # are reported. Returns a report dict.
+    if horizon_days < Config.MIN_RETENTION_DAYS:
+        raise ValueError(f"horizon_days must be at least {Config.MIN_RETENTION_DAYS}")
+
+    report = {"months": [], "deleted": 0, "mismatched": [], "daily_total": 0, "served_total": 0}
+
+    rolled = await _rolled_through()
+    if rolled is None:
+        report["note"] = "run rollup_months first"
+        return report
+
+    # Only months whose rollup is complete can be compacted
+    cutoff = min(
+        month_first_day(day_to_month(_get_today() - horizon_days)),
+        month_first_day(day_to_month(rolled + 1))
+    )
 
-def get_global_user_count():
-    return users_col.count_documents({})
\ No newline at end of file
+    col, _ = _message_writer()
+
+    # Months before this passed verification on an earlier run
+    compacted = await _compacted_before.__wrapped__()
+
+    # An index range on (date)
+    oldest = await col.find({}, {"_id": 0, "date": 1}).sort("date", ASCENDING).limit(1).to_list(None)
+    if not oldest or oldest[0]["date"] >= cutoff:
+        return report
+
+    for month in range(day_to_month(oldest[0]["date"]), day_to_month(cutoff)):
+        first = month_first_day(month)
+        last = month_first_day(month + 1) - 1
+
+        if compacted is not None and last < compacted:
+            # Readers already serve this month from its rollup, whatever
+            # daily documents are left (a run stopped while deleting) are
+            # not compared again, only deleted
+            if not verify_only:
+                report["deleted"] += await _delete_days(col, first, last, batch_size, pause)
+            continue
+
+        source, stages = _daily_source({"date": {"$gte": first, "$lte": last}})
+        daily = await _group_sums(source, stages)
+        if not daily:
+            continue
+
+        monthly = await _group_sums(monthly_col, [{"$match": {"month": month}}])
+
+        if daily != monthly and not verify_only:
+            # Late writes or a crash since the rollup, the daily documents
+            # are still here to rebuild it from
+            await _rollup_month(month, last)
+            monthly = await _group_sums(monthly_col, [{"$match": {"month": month}}])
+
+        if daily != monthly:
+            report["mismatched"].append(month)
+            if not verify_only:
+                logger.error("Month %s rollup does not match its daily counts", month)
+                break
+            continue
+
+        report["months"].append(month)
+        report["daily_total"] += sum(daily.values())
+
+        if verify_only:
+            report["served_total"] += await _range_sum(first, last)
+            continue
+
+        # Readers widen ranges over compacted days to whole months from here
+        await migrations_col.update_one(
+            {"_id": "compaction"},
+            {"$max": {"before": last + 1}},
+            upsert=True
+        )
+        _compacted_before.cache_clear()
+
+        report["deleted"] += await _delete_days(col, first, last, batch_size, pause)
+
+        # What the readers return for the month now that only its rollup
+        # is left, against what its daily documents held
+        report["served_total"] += await _range_sum(first, last)
+
+    if report["daily_total"] != report["served_total"]:
+        logger.error(
+            "Compacted months serve %s messages, their daily documents held %s",
+            report["served_total"], report["daily_total"]
+        )
+
+    return report
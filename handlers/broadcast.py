@@ -1,7 +1,24 @@
+import asyncio
+import logging
+import time
 from telegram import Update
+from telegram.error import RetryAfter, TelegramError
 from telegram.ext import ContextTypes
 from config import Config
-from database import messages_col
+from database import (
+    create_broadcast,
+    update_broadcast,
+    get_running_broadcasts,
+    iter_broadcast_targets
+)
+from ratelimit import outgoing
+
+logger = logging.getLogger(__name__)
+
+MAX_RETRIES = 3
+
+# Running jobs, cancelled on shutdown instead of awaited to completion
+_tasks = set()
 
 
 async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -11,16 +28,18 @@ async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ You are not authorized.")
         return
 
-    sent = 0
-    failed = 0
-
     # Determine broadcast content
     if update.message.reply_to_message:
-        broadcast_message = update.message.reply_to_message
-        mode = "reply"
+        job = {
+            "mode": "reply",
+            "from_chat_id": update.message.chat_id,
+            "message_id": update.message.reply_to_message.message_id
+        }
     elif context.args:
-        broadcast_text = " ".join(context.args)
-        mode = "text"
+        job = {
+            "mode": "text",
+            "text": " ".join(context.args)
+        }
     else:
         await update.message.reply_text(
             "Usage:\n"
@@ -30,24 +49,122 @@ async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    users = messages_col.distinct("user_id")
-    groups = messages_col.distinct("group_id")
+    progress = await update.message.reply_text("📢 Broadcast starting...")
+
+    job["admin_chat_id"] = progress.chat_id
+    job["progress_message_id"] = progress.message_id
+
+    job = await create_broadcast(job)
+    _start(context.bot, job)
+
+
+# =========================
+# BROADCAST ENGINE
+# =========================
 
-    targets = set(users + groups)
+def _start(bot, job):
+    task = asyncio.create_task(run_broadcast(bot, job))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def resume_broadcasts(application):
+    for job in await get_running_broadcasts():
+        _start(application.bot, job)
+
+
+def stop_broadcasts():
+    # Jobs stay "running" in Mongo and resume from their checkpoint
+    for task in _tasks:
+        task.cancel()
+
+
+async def _send(bot, job, chat_id):
+
+    for _ in range(MAX_RETRIES):
+        await outgoing.acquire()
 
-    for chat_id in targets:
         try:
-            if mode == "reply":
-                await broadcast_message.copy(chat_id)
+            if job["mode"] == "reply":
+                await bot.copy_message(chat_id, job["from_chat_id"], job["message_id"])
             else:
-                await context.bot.send_message(chat_id, broadcast_text)
+                await bot.send_message(chat_id, job["text"])
+            return True
+        except RetryAfter as e:
+            outgoing.pause(e.retry_after)
+        except TelegramError:
+            return False
+
+    return False
 
-            sent += 1
-        except:
-            failed += 1
 
-    await update.message.reply_text(
-        f"✅ Broadcast Completed\n\n"
-        f"✔ Sent: {sent}\n"
-        f"❌ Failed: {failed}"
+async def _report(bot, job, started, done_at_start, finished=False):
+
+    done = job["sent"] + job["failed"]
+    elapsed = time.monotonic() - started
+    rate = (done - done_at_start) / elapsed if elapsed else 0
+
+    if finished:
+        header = "✅ Broadcast Completed"
+        eta = ""
+    else:
+        header = "📢 Broadcast Running"
+        remaining = max(job["total"] - done, 0)
+        eta = f"\n⏳ ETA: {int(remaining / rate)}s" if rate else ""
+
+    text = (
+        f"{header}\n\n"
+        f"✔ Sent: {job['sent']}\n"
+        f"❌ Failed: {job['failed']}\n"
+        f"📊 Progress: {done}/{job['total']}"
+        f"{eta}"
     )
+
+    try:
+        await bot.edit_message_text(
+            text,
+            chat_id=job["admin_chat_id"],
+            message_id=job["progress_message_id"]
+        )
+    except TelegramError:
+        pass
+
+
+async def run_broadcast(bot, job):
+
+    started = time.monotonic()
+    done_at_start = job["sent"] + job["failed"]
+    last_report = started
+
+    try:
+        async for phase, chat_ids in iter_broadcast_targets(
+            job["phase"], job["last_id"], Config.BROADCAST_BATCH_SIZE
+        ):
+            results = await asyncio.gather(
+                *(_send(bot, job, chat_id) for chat_id in chat_ids)
+            )
+
+            sent = sum(results)
+            job["sent"] += sent
+            job["failed"] += len(results) - sent
+            job["phase"] = phase
+            job["last_id"] = chat_ids[-1]
+
+            # Checkpoint after every batch, a restart resends at most one batch
+            await update_broadcast(job["_id"], {
+                "phase": phase,
+                "last_id": job["last_id"],
+                "sent": job["sent"],
+                "failed": job["failed"]
+            })
+
+            if time.monotonic() - last_report >= Config.BROADCAST_PROGRESS_INTERVAL:
+                last_report = time.monotonic()
+                await _report(bot, job, started, done_at_start)
+    except Exception:
+        # Left as "running", so it resumes from the checkpoint on restart
+        logger.exception("Broadcast %s interrupted", job["_id"])
+        return
+
+    await update_broadcast(job["_id"], {"status": "done"})
+    await _report(bot, job, started, done_at_start, finished=True)
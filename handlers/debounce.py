@@ -0,0 +1,71 @@
+import asyncio
+import functools
+from telegram.error import TelegramError
+from cache import LRUCache
+from config import Config
+from ratelimit import TokenBucket
+
+THROTTLED_TEXT = "⏳ Too many requests here, try again in a moment."
+
+# Newest click per (user, chat, message) while its burst is collecting
+_latest = {}
+
+# Per-chat query budgets, an evicted (idle) chat starts again with a full one
+_budgets = LRUCache(10000)
+
+
+# =========================
+# CALLBACK DEBOUNCING
+# =========================
+
+# Register debounced callbacks with block=False: the wait must not hold the
+# chat's place in ChatOrderedUpdateProcessor, or the later clicks of the
+# burst would only arrive after it.
+
+def _budget(chat_id):
+    bucket = _budgets.get(chat_id)
+    if bucket is None:
+        bucket = TokenBucket(Config.CALLBACK_CHAT_RATE, Config.CALLBACK_CHAT_BURST)
+        _budgets.set(chat_id, bucket)
+    return bucket
+
+
+async def _answer(query, text=None):
+    try:
+        await query.answer(text)
+    except TelegramError:
+        pass
+
+
+def debounced(handler):
+
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        query = update.callback_query
+        message = query.message
+
+        if message:
+            chat_id, message_id = message.chat_id, message.message_id
+        else:
+            chat_id, message_id = query.from_user.id, query.inline_message_id
+
+        key = (query.from_user.id, chat_id, message_id)
+
+        previous = _latest.get(key)
+        _latest[key] = update
+
+        # The click already waiting picks this one up instead
+        if previous is not None:
+            await _answer(previous.callback_query)
+            return
+
+        await asyncio.sleep(Config.CALLBACK_DEBOUNCE_MS / 1000)
+        update = _latest.pop(key)
+
+        if not _budget(chat_id).try_acquire():
+            await _answer(update.callback_query, THROTTLED_TEXT)
+            return
+
+        await handler(update, context)
+
+    return wrapper
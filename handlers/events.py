@@ -1,17 +1,21 @@
 import random
-import asyncio
+import time
 from telegram import Update
+from telegram.error import RetryAfter, TelegramError
 from telegram.ext import ContextTypes
-from database import add_bonus_points
-from pymongo import MongoClient
 from config import Config
+from database import (
+    add_bonus_points,
+    iter_group_ids,
+    start_event,
+    claim_event,
+    get_active_event_groups
+)
+from ratelimit import outgoing
 
-# Mongo to get groups
-client = MongoClient(Config.MONGO_URI)
-db = client["chatfight"]
-messages_col = db["messages"]
-
-active_events = {}  # group_id: correct_answer
+# The shared state lives in Mongo. Events started by this process are also
+# remembered here so they are answerable before the next refresh.
+_local_events = {}  # group_id: expires_at (monotonic)
 
 
 # =========================
@@ -20,20 +24,34 @@ active_events = {}  # group_id: correct_answer
 
 async def auto_event(context: ContextTypes.DEFAULT_TYPE):
 
-    groups = messages_col.distinct("group_id")
+    # Each group gets its own job at a random offset inside the spread
+    # window, so sends (and the answers they trigger) don't all land at once
+    async for group_id in iter_group_ids():
+        context.job_queue.run_once(
+            send_event,
+            when=random.uniform(0, Config.EVENT_SPREAD),
+            data=group_id,
+            name=f"event:{group_id}"
+        )
+
 
-    for group_id in groups:
+async def send_event(context: ContextTypes.DEFAULT_TYPE):
 
-        a = random.randint(5, 20)
-        b = random.randint(5, 20)
-        answer = a + b
+    group_id = context.job.data
 
-        question = (
-            f"⚡ <b>QUICK EVENT</b>\n\n"
-            f"Solve: <b>{a} + {b}</b>\n"
-            f"🏆 Prize: +20 points\n"
-            f"⏳ First correct answer wins!"
-        )
+    a = random.randint(5, 20)
+    b = random.randint(5, 20)
+    answer = a + b
+
+    question = (
+        f"⚡ <b>QUICK EVENT</b>\n\n"
+        f"Solve: <b>{a} + {b}</b>\n"
+        f"🏆 Prize: +20 points\n"
+        f"⏳ First correct answer wins!"
+    )
+
+    for _ in range(2):
+        await outgoing.acquire()
 
         try:
             await context.bot.send_message(
@@ -41,11 +59,15 @@ async def auto_event(context: ContextTypes.DEFAULT_TYPE):
                 text=question,
                 parse_mode="HTML"
             )
-
-            active_events[group_id] = answer
-
-        except:
+        except RetryAfter as e:
+            outgoing.pause(e.retry_after)
             continue
+        except TelegramError:
+            return
+
+        await start_event(group_id, answer, Config.EVENT_TTL)
+        _local_events[group_id] = time.monotonic() + Config.EVENT_TTL
+        return
 
 
 # =========================
@@ -59,20 +81,24 @@ async def check_event_answer(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     group_id = update.message.chat.id
 
-    if group_id not in active_events:
-        return
+    # Cheap negative check, almost no group has an open event
+    if _local_events.get(group_id, 0) < time.monotonic():
+        _local_events.pop(group_id, None)
+
+        if group_id not in await get_active_event_groups():
+            return
 
     try:
         user_answer = int(update.message.text.strip())
     except:
         return
 
-    correct_answer = active_events[group_id]
+    if await claim_event(group_id, user_answer):
 
-    if user_answer == correct_answer:
+        _local_events.pop(group_id, None)
 
         user = update.message.from_user
-        add_bonus_points(user.id, group_id, 20)
+        await add_bonus_points(user.id, group_id, 20)
 
         await update.message.reply_text(
             f"🎉 {user.mention_html()} won +20 points! 🥳",
@@ -83,5 +109,3 @@ async def check_event_answer(update: Update, context: ContextTypes.DEFAULT_TYPE)
             await update.message.set_reaction("🎉")
         except:
             pass
-
-        del active_events[group_id]
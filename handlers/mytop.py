@@ -2,28 +2,34 @@ import html
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes
 from database import get_user_groups_stats, get_total_group_messages
+from handlers.titles import resolve_group_titles
+from metrics import timed
 
 
 async def mytop(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await send_mytop(update, context, "overall")
 
 
+@timed
 async def send_mytop(update, context, mode):
     user_id = update.effective_user.id
-    data = get_user_groups_stats(user_id, mode)
+    data = await get_user_groups_stats(user_id, mode)
 
     text = "📈 <b>TOP GROUPS</b> | 🌍\n\n"
 
     if not data:
         text += "No activity yet."
     else:
+        titles = await resolve_group_titles(
+            context.bot, [group_id for group_id, _ in data]
+        )
+
         for i, (group_id, count) in enumerate(data, start=1):
-            try:
-                chat = await context.bot.get_chat(group_id)
-                name = html.escape(chat.title or "Group")
-            except:
+            if group_id not in titles:
                 continue
 
+            name = html.escape(titles[group_id])
+
             text += f"{i}. 👥 {name} • {count:,}\n"
 
     keyboard = [
@@ -0,0 +1,76 @@
+import asyncio
+import cProfile
+import io
+import multiprocessing
+import pstats
+import time
+from telegram import Update
+from telegram.ext import ContextTypes
+from config import Config
+
+DEFAULT_SECONDS = 30
+MAX_SECONDS = 300
+TOP_FUNCTIONS = 40
+
+# Only one profiling session at a time (cProfile is per process)
+_running = False
+
+
+async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    global _running
+
+    # 🔐 Owner check
+    if update.effective_user.id != Config.ADMIN_ID:
+        await update.message.reply_text("❌ You are not authorized.")
+        return
+
+    try:
+        seconds = int(context.args[0]) if context.args else DEFAULT_SECONDS
+    except ValueError:
+        await update.message.reply_text("Usage:\n/profile [seconds]")
+        return
+
+    seconds = max(1, min(seconds, MAX_SECONDS))
+
+    if _running:
+        await update.message.reply_text("⏳ A profile is already running.")
+        return
+
+    text = f"🔬 Profiling for {seconds}s..."
+    process = multiprocessing.current_process().name
+    if process != "MainProcess":
+        # workers.py: the other workers' processes are not profiled
+        text += f"\n\nOnly {process} (the worker handling this chat) is profiled."
+
+    # Every handler runs on this event loop's thread, so enabling the
+    # profiler here records all of them until it is disabled again
+    profiler = cProfile.Profile()
+    _running = True
+
+    try:
+        await update.message.reply_text(text)
+
+        started = time.monotonic()
+        profiler.enable()
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.disable()
+        _running = False
+
+    elapsed = time.monotonic() - started
+
+    report = io.StringIO()
+    report.write(f"Profile of {elapsed:.1f}s\n\n")
+
+    stats = pstats.Stats(profiler, stream=report)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_FUNCTIONS)
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(TOP_FUNCTIONS)
+
+    document = io.BytesIO(report.getvalue().encode())
+
+    await update.message.reply_document(
+        document=document,
+        filename=f"profile-{int(time.time())}.txt",
+        caption=f"🔬 Top functions over {elapsed:.0f}s"
+    )
@@ -6,8 +6,9 @@ from telegram.error import BadRequest
 from database import (
     get_leaderboard,
     get_total_group_messages,
-    get_user_info
+    get_users_info
 )
+from metrics import timed
 
 
 async def rankings(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -18,11 +19,12 @@ async def rankings(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await send_leaderboard(update, context, "overall")
 
 
+@timed
 async def send_leaderboard(update, context, mode):
 
     group_id = update.effective_chat.id
-    data = get_leaderboard(group_id, mode)
-    total_messages = get_total_group_messages(group_id, mode)
+    data = await get_leaderboard(group_id, mode)
+    total_messages = await get_total_group_messages(group_id, mode)
 
     text = "📈 <b>LEADERBOARD</b>\n\n"
 
@@ -31,9 +33,11 @@ async def send_leaderboard(update, context, mode):
     else:
         medals = ["🥇", "🥈", "🥉"]
 
+        users = await get_users_info([user_id for user_id, _ in data])
+
         for i, (user_id, count) in enumerate(data, start=1):
 
-            user_doc = get_user_info(user_id)
+            user_doc = users.get(user_id)
 
             if user_doc and user_doc.get("full_name"):
                 full_name = user_doc["full_name"]
@@ -5,7 +5,7 @@ async def stats(update, context):
     await query.answer()
 
     user_id = query.from_user.id
-    count = get_user_stats(user_id)
+    count = await get_user_stats(user_id)
 
     await query.edit_message_text(
         f"📊 YOUR STATS\n\nMessages sent: {count}"
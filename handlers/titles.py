@@ -0,0 +1,40 @@
+import asyncio
+from telegram.error import TelegramError
+from config import Config
+from database import get_group_titles, save_group_titles
+
+
+# =========================
+# GROUP TITLE RESOLUTION
+# =========================
+
+async def resolve_group_titles(bot, group_ids):
+
+    titles = await get_group_titles(group_ids)
+    unknown = [group_id for group_id in group_ids if group_id not in titles]
+
+    if not unknown:
+        return titles
+
+    # Only groups never seen by the counter reach the Bot API
+    limit = asyncio.Semaphore(Config.GET_CHAT_CONCURRENCY)
+
+    async def fetch(group_id):
+        async with limit:
+            try:
+                chat = await bot.get_chat(group_id)
+            except TelegramError:
+                return None
+            return chat.title or "Group"
+
+    fetched = await asyncio.gather(*(fetch(group_id) for group_id in unknown))
+    found = {
+        group_id: title
+        for group_id, title in zip(unknown, fetched)
+        if title is not None
+    }
+
+    await save_group_titles(found)
+
+    titles.update(found)
+    return titles
@@ -1,18 +1,28 @@
 import html
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
-from telegram.error import BadRequest
+from telegram.error import BadRequest, TelegramError
 from telegram.ext import ContextTypes
-from database import get_top_groups, get_total_global_messages
+from database import board_stamp, get_top_groups, get_total_global_messages, result_ttl
+from handlers import views
+from handlers.titles import resolve_group_titles
+from metrics import timed
 
 
 async def topgroups(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await send_top_groups(update, context, "overall")
 
 
+@timed
 async def send_top_groups(update, context, mode):
 
-    data = get_top_groups(mode)
-    total_messages = get_total_global_messages(mode)
+    query = update.callback_query
+
+    state = ("groups", mode, board_stamp("groups", mode))
+    if query and views.is_current(query, state, result_ttl(mode)):
+        return
+
+    data = await get_top_groups(mode)
+    total_messages = await get_total_global_messages(mode)
 
     text = "📈 <b>TOP GROUPS</b> 🌍\n\n"
 
@@ -21,12 +31,12 @@ async def send_top_groups(update, context, mode):
     else:
         medals = ["🥇", "🥈", "🥉"]
 
+        titles = await resolve_group_titles(
+            context.bot, [group_id for group_id, _ in data]
+        )
+
         for i, (group_id, count) in enumerate(data, start=1):
-            try:
-                chat = await context.bot.get_chat(group_id)
-                safe_name = html.escape(chat.title or "Group")
-            except:
-                safe_name = f"Group {group_id}"
+            safe_name = html.escape(titles.get(group_id, f"Group {group_id}"))
 
             medal = medals[i - 1] if i <= 3 else f"{i}."
             text += f"{medal} 👥 {safe_name} • {count:,}\n"
@@ -55,12 +65,9 @@ async def send_top_groups(update, context, mode):
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     # 🔥 SAFE RESPONSE HANDLING
-    if update.callback_query:
-        query = update.callback_query
-        try:
-            await query.answer(cache_time=0)
-        except:
-            pass
+    if query:
+        if views.is_rendered(query, state, text, reply_markup):
+            return
 
         try:
             await query.edit_message_text(
@@ -69,8 +76,10 @@ async def send_top_groups(update, context, mode):
                 reply_markup=reply_markup,
                 disable_web_page_preview=True
             )
-        except BadRequest:
-            pass
+        except TelegramError as e:
+            # The message may not show what was recorded for it
+            if "Message is not modified" not in str(e):
+                views.forget(query)
     else:
         try:
             await update.message.reply_text(
@@ -1,13 +1,18 @@
 import html
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes
-from telegram.error import BadRequest
+from telegram.error import TelegramError
 
+from config import Config
 from database import (
+    board_stamp,
     get_global_leaderboard,
     get_total_global_messages,
-    get_user_info
+    get_users_info,
+    result_ttl
 )
+from handlers import views
+from metrics import timed
 
 
 # =========================
@@ -22,10 +27,23 @@ async def topusers(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # MAIN FUNCTION
 # =========================
 
-async def send_global_leaderboard(update, context, mode):
+@timed
+async def send_global_leaderboard(update, context, mode, page=0):
 
-    data = get_global_leaderboard(mode)
-    total_messages = get_total_global_messages(mode)
+    query = update.callback_query
+
+    state = ("global", mode, page, board_stamp("users", mode))
+    if query and views.is_current(query, state, result_ttl(mode)):
+        return
+
+    offset = page * views.PAGE_SIZE
+
+    # One extra row tells whether there is a next page
+    data = await get_global_leaderboard(mode, views.PAGE_SIZE + 1, offset)
+    total_messages = await get_total_global_messages(mode)
+
+    has_next = len(data) > views.PAGE_SIZE and page + 1 < Config.LEADERBOARD_MAX_PAGES
+    data = data[:views.PAGE_SIZE]
 
     text = "📈 <b>GLOBAL LEADERBOARD</b> 🌍\n\n"
     medals = ["🥇", "🥈", "🥉"]
@@ -33,9 +51,11 @@ async def send_global_leaderboard(update, context, mode):
     if not data:
         text += "No data yet."
     else:
-        for i, (user_id, count) in enumerate(data, start=1):
+        users = await get_users_info([user_id for user_id, _ in data])
+
+        for i, (user_id, count) in enumerate(data, start=offset + 1):
 
-            user_doc = get_user_info(user_id)
+            user_doc = users.get(user_id)
 
             if user_doc and user_doc.get("full_name"):
                 full_name = user_doc["full_name"]
@@ -66,27 +86,37 @@ async def send_global_leaderboard(update, context, mode):
                 "Week ✅" if mode == "week" else "Week",
                 callback_data="g_week"
             ),
+            InlineKeyboardButton(
+                "Month ✅" if mode == "month" else "Month",
+                callback_data="g_month"
+            ),
         ]
     ]
 
+    pages = views.page_buttons("g", mode, page, has_next)
+    if pages:
+        keyboard.append(pages)
+
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     # =========================
     # SAFE EDIT OR SEND
     # =========================
 
-    if update.callback_query:
+    if query:
+        if views.is_rendered(query, state, text, reply_markup):
+            return
         try:
-            await update.callback_query.edit_message_text(
+            await query.edit_message_text(
                 text=text,
                 parse_mode="HTML",
                 reply_markup=reply_markup,
                 disable_web_page_preview=True
             )
-        except BadRequest as e:
-            # Ignore if message not modified
+        except TelegramError as e:
+            # The message may not show what was recorded for it
             if "Message is not modified" not in str(e):
-                raise
+                views.forget(query)
     else:
         await update.message.reply_text(
             text=text,
@@ -109,13 +139,5 @@ async def global_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except:
         pass
 
-    mode = "overall"
-
-    if query.data == "g_today":
-        mode = "today"
-    elif query.data == "g_week":
-        mode = "week"
-    elif query.data == "g_overall":
-        mode = "overall"
-
-    await send_global_leaderboard(update, context, mode)
+    mode, page = views.parse_page(query.data)
+    await send_global_leaderboard(update, context, mode, page)
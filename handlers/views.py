@@ -0,0 +1,81 @@
+import time
+from telegram import InlineKeyboardButton
+from cache import LRUCache
+from config import Config
+
+
+# =========================
+# RENDERED VIEW FINGERPRINTS
+# =========================
+
+# What each leaderboard message currently shows:
+# (chat_id, message_id): (state, fingerprint, drawn_at)
+# `state` is whatever the view was built from (view, mode, board stamp) and
+# lets an unchanged view skip its queries; the fingerprint of the rendered
+# text and buttons lets it skip the edit when the state is unknown.
+
+_views = LRUCache(Config.VIEW_CACHE_SIZE)
+
+
+def _key(query):
+    message = query.message
+    if message:
+        return message.chat_id, message.message_id
+    return query.inline_message_id
+
+
+def fingerprint(text, reply_markup):
+    return hash((text, reply_markup.to_json() if reply_markup else None))
+
+
+def is_current(query, state, max_age):
+    # True when the message already shows this exact state, drawn less than
+    # `max_age` seconds ago: the board stamp doesn't cover the cached
+    # "Total messages", which may have been stale when the view was drawn
+    if state is None or state[-1] is None:
+        return False
+
+    view = _views.get(_key(query))
+    return (
+        view is not None and view[0] == state
+        and time.monotonic() - view[2] < max_age
+    )
+
+
+def is_rendered(query, state, text, reply_markup):
+    # True when the message already shows this text, otherwise records it
+    # as the new content (call right before editing)
+    key = _key(query)
+    new = fingerprint(text, reply_markup)
+    view = _views.get(key)
+
+    _views.set(key, (state, new, time.monotonic()))
+    return view is not None and view[1] == new
+
+
+def forget(query):
+    _views.pop(_key(query))
+
+
+# =========================
+# PAGINATION
+# =========================
+
+PAGE_SIZE = 10
+
+
+def parse_page(data):
+    # "<prefix>_<mode>" or "<prefix>_<mode>_<page>"
+    parts = data.split("_")
+    mode = parts[1] if len(parts) > 1 and parts[1] in ("today", "week", "month") else "overall"
+    page = int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else 0
+    return mode, min(page, Config.LEADERBOARD_MAX_PAGES - 1)
+
+
+def page_buttons(prefix, mode, page, has_next):
+    buttons = []
+    if page:
+        buttons.append(InlineKeyboardButton("◀ Prev", callback_data=f"{prefix}_{mode}_{page - 1}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton("Next ▶", callback_data=f"{prefix}_{mode}_{page + 1}"))
+    return buttons
@@ -0,0 +1,117 @@
+import heapq
+from operator import itemgetter
+
+from cache import LRUCache
+
+
+# =========================
+# TOP-K BOARD
+# =========================
+
+# A board holds exact counts for the members it knows about. Members that
+# were cut off (not loaded, or truncated away) are only known to have had at
+# most `floor` messages, so their new increments are tracked separately as
+# upper bounds. top() refuses to answer when one of them could have climbed
+# into the requested rows, and the caller reloads from Mongo.
+
+class Board:
+
+    def __init__(self, rows, floor, day, max_entries):
+        self.entries = dict(rows)   # member_id: exact count
+        self.floor = floor
+        self.day = day
+        self.max_entries = max_entries
+        self.pending = {}           # member_id: count since load (cut off)
+        self.pending_max = 0
+        self.version = 0
+        self.generation = 0         # set by the engine, unique per load
+        self._top = None            # (version, rows)
+
+    def add(self, member_id, count):
+        self.version += 1
+
+        if member_id in self.entries:
+            self.entries[member_id] += count
+        elif not self.floor:
+            self.entries[member_id] = count
+        else:
+            value = self.pending.get(member_id, 0) + count
+            self.pending[member_id] = value
+            self.pending_max = max(self.pending_max, value)
+
+        if len(self.entries) > self.max_entries:
+            self._truncate()
+
+    def _truncate(self):
+        keep = self.max_entries // 2
+        ranked = sorted(self.entries.items(), key=itemgetter(1), reverse=True)
+
+        self.entries = dict(ranked[:keep])
+        self.floor = max(self.floor, ranked[keep][1])
+        self._top = None
+
+    def top(self, limit):
+
+        if self._top and self._top[0] == self.version and len(self._top[1]) >= limit:
+            return self._top[1][:limit]
+
+        rows = heapq.nlargest(limit, self.entries.items(), key=itemgetter(1))
+
+        # Cut off members could beat the last row, the answer is not exact
+        if self.floor:
+            bound = self.floor + self.pending_max
+            if len(rows) < limit or rows[-1][1] < bound:
+                return None
+
+        self._top = (self.version, rows)
+        return rows
+
+
+# =========================
+# ENGINE
+# =========================
+
+class LeaderboardEngine:
+
+    MODES = ("today", "week", "overall")
+
+    def __init__(self, max_boards, max_entries):
+        self.max_entries = max_entries
+        self._boards = LRUCache(max_boards)  # (scope, mode): Board
+        self._loads = 0
+
+    def get(self, scope, mode, today):
+        board = self._boards.get((scope, mode))
+
+        # Windowed boards are dropped when the day rolls over
+        if board is not None and mode != "overall" and board.day != today:
+            self._boards.pop((scope, mode))
+            return None
+
+        return board
+
+    def build(self, rows, complete, today):
+        # A board that is not kept (see load)
+        floor = 0 if complete or not rows else rows[-1][1]
+        return Board(rows, floor, today, self.max_entries)
+
+    def load(self, scope, mode, rows, complete, today):
+        board = self.build(rows, complete, today)
+        self._loads += 1
+        board.generation = self._loads
+        self._boards.set((scope, mode), board)
+        return board
+
+    def add(self, user_id, group_id, today, count=1):
+        for mode in self.MODES:
+            for scope, member_id in (
+                (("group", group_id), user_id),
+                ("users", user_id),
+                ("groups", group_id),
+            ):
+                board = self._boards.get((scope, mode))
+                if board is not None and (mode == "overall" or board.day == today):
+                    board.add(member_id, count)
+
+    def clear(self):
+        self._boards.clear()
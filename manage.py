@@ -0,0 +1,129 @@
+import argparse
+import asyncio
+
+import database
+from config import Config
+
+
+# =========================
+# COMMANDS
+# =========================
+
+async def init_indexes(args):
+    await database.create_indexes()
+    print("Indexes are in place")
+
+
+async def rebuild_totals(args):
+    # $merge needs the unique (group_id, user_id) index
+    await database.create_indexes()
+    count = await database.rebuild_totals()
+    print(f"Rebuilt totals for {count:,} group members")
+
+
+async def rollup_months(args):
+    await database.create_indexes()
+    months = await database.rollup_months()
+    print(f"Rebuilt {months:,} monthly rollups")
+
+
+async def compact(args):
+    await database.create_indexes()
+    await database.rollup_months()
+    report = await database.compact_daily(
+        args.horizon_days, args.batch_size, args.pause, verify_only=args.verify
+    )
+
+    months = [
+        database.day_to_date(database.month_first_day(month)).strftime("%Y-%m")
+        for month in report["months"]
+    ]
+    action = "Verified" if args.verify else "Compacted"
+    print(f"{action} {len(months)} months: {', '.join(months) or '-'}")
+
+    if not args.verify:
+        print(f"Deleted {report['deleted']:,} daily documents")
+    if report["months"]:
+        print(f"Daily total {report['daily_total']:,}, served total {report['served_total']:,}")
+    if report["mismatched"]:
+        print(f"Rollup mismatch in months: {report['mismatched']}")
+    if report.get("note"):
+        print(report["note"])
+
+
+async def migrate_day_keys(args):
+    converted, merged = await database.migrate_day_keys(args.batch_size, args.pause)
+    print(f"Converted {converted:,} daily documents, merged {merged:,} duplicates")
+
+
+async def migrate_to_buckets(args):
+    await database.create_indexes()
+    moved = await database.migrate_to_buckets(args.batch_size, args.pause)
+    print(f"Copied {moved:,} daily documents into buckets")
+
+
+BATCH_ARGUMENTS = [
+    (("--batch-size",), {"type": int, "default": 1000}),
+    (("--pause",), {"type": float, "default": 0.1, "help": "seconds between batches"}),
+]
+
+COMPACT_ARGUMENTS = BATCH_ARGUMENTS + [
+    (("--horizon-days",), {"type": int, "default": Config.RETENTION_DAYS or 180,
+                           "help": "keep daily documents of the last N days"}),
+    (("--verify",), {"action": "store_true", "help": "only cross-check rollups against daily sums"}),
+]
+
+COMMANDS = {
+    "init-indexes": (
+        init_indexes,
+        "Create every collection index (safe to re-run)",
+        []
+    ),
+    "rebuild-totals": (
+        rebuild_totals,
+        "Recompute the per group/user totals rollup (run with the bot stopped)",
+        []
+    ),
+    "rollup-months": (
+        rollup_months,
+        "Roll closed days into the monthly counts (safe online, also runs in the bot)",
+        []
+    ),
+    "compact": (
+        compact,
+        "Fold daily documents older than the horizon into monthly rollups (safe online)",
+        COMPACT_ARGUMENTS
+    ),
+    "migrate-day-keys": (
+        migrate_day_keys,
+        "Convert legacy YYYY-MM-DD message dates to integer days (safe online)",
+        BATCH_ARGUMENTS
+    ),
+    "migrate-to-buckets": (
+        migrate_to_buckets,
+        "Copy daily documents into group/day buckets (run with the bot stopped)",
+        BATCH_ARGUMENTS
+    ),
+}
+
+
+# =========================
+# ENTRY
+# =========================
+
+def main():
+    parser = argparse.ArgumentParser(description="ChatFight maintenance tasks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    for name, (func, help_text, arguments) in COMMANDS.items():
+        command = subparsers.add_parser(name, help=help_text)
+        command.set_defaults(func=func)
+        for flags, kwargs in arguments:
+            command.add_argument(*flags, **kwargs)
+
+    args = parser.parse_args()
+    asyncio.run(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
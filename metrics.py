@@ -0,0 +1,321 @@
+import asyncio
+import functools
+import logging
+import threading
+import time
+
+from pymongo import monitoring
+from telegram.request import HTTPXRequest
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Prometheus text-format metrics on http://METRICS_LISTEN:METRICS_PORT/metrics
+# (METRICS_PORT=0 keeps everything off, and `timed` is then a no-op)
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# pymongo calls command listeners from motor's worker threads
+_lock = threading.Lock()
+
+
+def enabled():
+    return bool(Config.METRICS_PORT)
+
+
+# =========================
+# METRIC TYPES
+# =========================
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{str(value)}"' for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+def _series_key(item):
+    # Label values may mix types (an int status next to an exception name)
+    return tuple(str(value) for value in item[0])
+
+
+class Histogram:
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._series = {}  # label values: [bucket counts..., count, sum]
+
+    def observe(self, seconds, *values):
+        with _lock:
+            series = self._series.get(values)
+            if series is None:
+                series = self._series[values] = [0] * (len(BUCKETS) + 2)
+
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += seconds
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+
+        with _lock:
+            series = {values: list(data) for values, data in self._series.items()}
+
+        for values, data in sorted(series.items(), key=_series_key):
+            for bound, count in zip(BUCKETS, data):
+                labels = _labels(self.labels + ("le",), values + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {count}")
+
+            labels = _labels(self.labels + ("le",), values + ("+Inf",))
+            lines.append(f"{self.name}_bucket{labels} {data[-2]}")
+
+            labels = _labels(self.labels, values)
+            lines.append(f"{self.name}_count{labels} {data[-2]}")
+            lines.append(f"{self.name}_sum{labels} {data[-1]:.6f}")
+
+        return lines
+
+
+class Counter:
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._series = {}
+
+    def inc(self, *values):
+        with _lock:
+            self._series[values] = self._series.get(values, 0) + 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+
+        with _lock:
+            series = dict(self._series)
+
+        for values, count in sorted(series.items(), key=_series_key):
+            lines.append(f"{self.name}{_labels(self.labels, values)} {count}")
+
+        return lines
+
+
+class Gauge:
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def render(self):
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {self.value}"
+        ]
+
+
+handler_seconds = Histogram(
+    "chatfight_handler_seconds", "Handler latency", ("handler",)
+)
+handler_errors = Counter(
+    "chatfight_handler_errors_total", "Handlers that raised", ("handler",)
+)
+mongo_seconds = Histogram(
+    "chatfight_mongo_command_seconds", "Mongo command latency", ("collection", "command")
+)
+mongo_errors = Counter(
+    "chatfight_mongo_command_errors_total", "Failed Mongo commands", ("collection", "command")
+)
+bot_api_seconds = Histogram(
+    "chatfight_bot_api_seconds", "Bot API request latency", ("method",)
+)
+bot_api_errors = Counter(
+    "chatfight_bot_api_errors_total", "Bot API requests that failed", ("method", "status")
+)
+loop_lag_seconds = Histogram(
+    "chatfight_event_loop_lag_seconds", "Event loop scheduling delay"
+)
+loop_lag_last = Gauge(
+    "chatfight_event_loop_lag_last_seconds", "Most recent event loop delay"
+)
+
+REGISTRY = [
+    handler_seconds, handler_errors,
+    mongo_seconds, mongo_errors,
+    bot_api_seconds, bot_api_errors,
+    loop_lag_seconds, loop_lag_last
+]
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# =========================
+# HANDLERS
+# =========================
+
+def timed(func, name=None):
+
+    if not enabled():
+        return func
+
+    name = name or func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - started, name)
+
+    return wrapper
+
+
+def instrument_handlers(application):
+    # Times every registered handler callback under its function name
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            handler.callback = timed(handler.callback)
+
+
+# =========================
+# MONGO
+# =========================
+
+class MongoCommandListener(monitoring.CommandListener):
+
+    def __init__(self):
+        self._pending = {}  # (connection, request_id): (collection, command)
+
+    def started(self, event):
+        # getMore names its cursor id first, the collection comes after
+        if event.command_name == "getMore":
+            target = event.command.get("collection")
+        else:
+            target = event.command.get(event.command_name)
+        collection = target if isinstance(target, str) else "-"
+        self._pending[(event.connection_id, event.request_id)] = (
+            collection, event.command_name
+        )
+
+    def _finish(self, event):
+        return self._pending.pop(
+            (event.connection_id, event.request_id), ("-", event.command_name)
+        )
+
+    def succeeded(self, event):
+        labels = self._finish(event)
+        mongo_seconds.observe(event.duration_micros / 1e6, *labels)
+
+    def failed(self, event):
+        labels = self._finish(event)
+        mongo_seconds.observe(event.duration_micros / 1e6, *labels)
+        mongo_errors.inc(*labels)
+
+
+def mongo_listeners():
+    return [MongoCommandListener()] if enabled() else []
+
+
+# =========================
+# BOT API
+# =========================
+
+class InstrumentedRequest(HTTPXRequest):
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+
+        try:
+            status, payload = await super().do_request(url, method, request_data, **kwargs)
+        except Exception as e:
+            bot_api_errors.inc(api_method, type(e).__name__)
+            raise
+        finally:
+            bot_api_seconds.observe(time.perf_counter() - started, api_method)
+
+        if status >= 400:
+            bot_api_errors.inc(api_method, str(status))
+
+        return status, payload
+
+
+# =========================
+# EVENT LOOP LAG
+# =========================
+
+async def _watch_loop_lag(interval=0.5):
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(time.perf_counter() - started - interval, 0)
+        loop_lag_seconds.observe(lag)
+        loop_lag_last.set(round(lag, 6))
+
+
+# =========================
+# HTTP ENDPOINT
+# =========================
+
+async def _serve(reader, writer):
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()).strip():
+            pass
+
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1] == "/metrics":
+            status, body = "200 OK", render().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: text/plain; version=0.0.4\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+_tasks = []
+
+
+async def start_metrics_server():
+    if not enabled():
+        return
+
+    server = await asyncio.start_server(_serve, Config.METRICS_LISTEN, Config.METRICS_PORT)
+    _tasks.append(asyncio.create_task(server.serve_forever()))
+    _tasks.append(asyncio.create_task(_watch_loop_lag()))
+    logger.warning("Metrics on %s:%s/metrics", Config.METRICS_LISTEN, Config.METRICS_PORT)
+
+
+def stop_metrics_server():
+    for task in _tasks:
+        task.cancel()
+    _tasks.clear()
@@ -0,0 +1,61 @@
+import asyncio
+import logging
+from collections import deque
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+# =========================
+# PER-CHAT ORDERED PROCESSING
+# =========================
+
+# Updates from different chats run concurrently (at most `concurrency` at a
+# time), updates from the same chat run one after another in arrival order.
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+
+    def __init__(self, concurrency):
+        # Each slot of the base semaphore serves one chat: the first update
+        # of an idle chat keeps its slot and runs the chat's queue until it
+        # is empty, later updates of that chat are queued and return at
+        # once, so a busy chat never holds more than one slot
+        super().__init__(concurrency)
+        self._chats = {}  # chat_id: deque of coroutines still to run
+
+    async def do_process_update(self, update, coroutine):
+
+        chat_id = None
+        if isinstance(update, Update) and update.effective_chat:
+            chat_id = update.effective_chat.id
+
+        if chat_id is None:
+            await coroutine
+            return
+
+        queue = self._chats.get(chat_id)
+        if queue is not None:
+            queue.append(coroutine)
+            return
+
+        queue = self._chats[chat_id] = deque([coroutine])
+
+        try:
+            while queue:
+                try:
+                    await queue.popleft()
+                except Exception:
+                    logger.exception("Update for chat %s failed", chat_id)
+        finally:
+            del self._chats[chat_id]
+            # Only left over when cancelled (shutdown)
+            for pending in queue:
+                pending.close()
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,62 @@
+import asyncio
+import time
+
+from config import Config
+
+
+# =========================
+# TOKEN BUCKET
+# =========================
+
+class TokenBucket:
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity,
+            self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+        return now
+
+    def try_acquire(self):
+        now = self._refill()
+
+        if now < self._paused_until or self._tokens < 1:
+            return False
+
+        self._tokens -= 1
+        return True
+
+    async def acquire(self):
+        # The lock keeps waiters in FIFO order
+        async with self._lock:
+            while True:
+                now = self._refill()
+
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds):
+        # Telegram's RetryAfter applies to the whole bot, so everyone waits
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+
+# Shared budget for bulk sends (broadcasts, events)
+outgoing = TokenBucket(Config.BOT_API_RATE)
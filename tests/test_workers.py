@@ -0,0 +1,139 @@
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+# Needs requirements-dev.txt (mongomock-motor is loaded inside the workers):
+#   pip install -r requirements-dev.txt && python -m pytest tests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SITE = os.path.join(ROOT, "tests", "worker_site")
+
+WORKERS = 2
+CHATS = (-1001, -1002, -1003, -1004, -1005)
+MESSAGES = 60
+
+
+# =========================
+# STUB BOT API
+# =========================
+
+class StubBotAPI(BaseHTTPRequestHandler):
+
+    # Accepts every method: getMe gets a bot user, everything else `true`
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        method = self.path.rsplit("/", 1)[-1]
+
+        if method == "getMe":
+            result = {"id": 42, "is_bot": True, "first_name": "Bot", "username": "bench_bot"}
+        else:
+            result = True
+
+        body = json.dumps({"ok": True, "result": result}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def bot_api():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubBotAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/bot"
+    server.shutdown()
+
+
+# =========================
+# FAKE UPDATE SOURCE
+# =========================
+
+def message_update(update_id, chat_id, user_id):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": chat_id, "type": "group", "title": f"Group {chat_id}"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"},
+            "text": "hello"
+        }
+    }
+
+
+async def fake_feed(bot):
+    for update_id in range(MESSAGES):
+        yield message_update(update_id, CHATS[update_id % len(CHATS)], 100 + update_id % 7)
+
+
+# =========================
+# TEST
+# =========================
+
+def test_workers_keep_chat_order_and_flush_on_shutdown(bot_api, monkeypatch, tmp_path):
+
+    # Spawned workers inherit this environment (it wins over .env)
+    env = {
+        "BOT_TOKEN": "42:TEST",
+        "BOT_API_URL": bot_api,
+        "ADMIN_ID": "1",
+        "LOG_GROUP_ID": "-1",
+        "MONGO_URI": "mongodb://localhost:27017",
+        "MONGO_DB": "chatfight_test",
+        "MONGO_READ_PREFERENCE": "primary",
+        "MONGO_INDEX_BOOTSTRAP": "off",
+        "FLUSH_INTERVAL_MS": "3600000",
+        "EVENT_INTERVAL": "0",
+        "METRICS_PORT": "0",
+        "WORKERS_TEST_LOG": str(tmp_path),
+        "PYTHONPATH": os.pathsep.join([SITE, ROOT]),
+    }
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+
+    monkeypatch.syspath_prepend(ROOT)
+    for module in ("config", "workers"):
+        monkeypatch.delitem(sys.modules, module, raising=False)
+
+    import workers
+
+    workers.run(WORKERS, source_factory=fake_feed)
+
+    logs = {}
+    for name in os.listdir(tmp_path):
+        with open(tmp_path / name) as log:
+            logs[name] = [json.loads(line) for line in log]
+
+    assert len(logs) == WORKERS
+
+    seen = {}  # chat_id: (log, update ids in the order they ran)
+    for name, entries in logs.items():
+        for entry in entries:
+            if "chat" in entry:
+                log, updates = seen.setdefault(entry["chat"], (name, []))
+                assert log == name, f"chat {entry['chat']} ran on two workers"
+                updates.append(entry["update"])
+
+    for chat_id in CHATS:
+        expected = [i for i in range(MESSAGES) if CHATS[i % len(CHATS)] == chat_id]
+        assert seen[chat_id][1] == expected
+
+    # Every worker flushed its whole share of counts, the last flush (on
+    # shutdown) leaving nothing behind
+    for name, entries in logs.items():
+        handled = sum(1 for entry in entries if "chat" in entry)
+        flushes = [entry for entry in entries if "flushed" in entry]
+
+        assert handled
+        assert flushes and flushes[-1]["left"] == 0
+        assert sum(entry["flushed"] for entry in flushes) == handled
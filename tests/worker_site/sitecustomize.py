@@ -0,0 +1,45 @@
+import json
+import os
+
+# Loaded by every worker process test_workers.py spawns (through PYTHONPATH):
+# swaps Mongo for mongomock and records, per process, the updates each chat
+# ran in order and every flush of the counter buffer.
+
+LOG_DIR = os.environ.get("WORKERS_TEST_LOG")
+
+if LOG_DIR:
+    import mongomock_motor
+    import motor.motor_asyncio
+
+    motor.motor_asyncio.AsyncIOMotorClient = mongomock_motor.AsyncMongoMockClient
+
+    import database
+    import processor
+
+    _path = os.path.join(LOG_DIR, f"{os.getpid()}.jsonl")
+
+    def _record(**entry):
+        with open(_path, "a") as log:
+            log.write(json.dumps(entry) + "\n")
+
+    async def _logged(update, coroutine):
+        # Runs once the update holds its chat's lock
+        if update.effective_chat:
+            _record(chat=update.effective_chat.id, update=update.update_id)
+        await coroutine
+
+    _do_process_update = processor.ChatOrderedUpdateProcessor.do_process_update
+
+    async def do_process_update(self, update, coroutine):
+        await _do_process_update(self, update, _logged(update, coroutine))
+
+    processor.ChatOrderedUpdateProcessor.do_process_update = do_process_update
+
+    _flush_pending = database._flush_pending
+
+    async def flush_pending():
+        flushed = sum(database._pending_counts.values())
+        await _flush_pending()
+        _record(flushed=flushed, left=len(database._pending_counts))
+
+    database._flush_pending = flush_pending
@@ -0,0 +1,159 @@
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import signal
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Workers are spawned (not forked) so each one starts its own event loop,
+# Mongo client, counter buffer and caches from scratch
+_mp = multiprocessing.get_context("spawn")
+
+
+# =========================
+# ROUTING
+# =========================
+
+def route(update_data, workers):
+
+    # Every update of a chat goes to the same worker, which keeps per-chat
+    # ordering and lets each worker own its groups' counters and boards
+    for key in ("message", "edited_message", "channel_post", "my_chat_member",
+                "chat_member", "chat_join_request"):
+        if key in update_data:
+            return update_data[key]["chat"]["id"] % workers
+
+    query = update_data.get("callback_query")
+    if query:
+        if "message" in query:
+            return query["message"]["chat"]["id"] % workers
+        return query["from"]["id"] % workers
+
+    return 0
+
+
+# =========================
+# WORKER
+# =========================
+
+def worker_main(index, workers, queue):
+
+    # Ctrl+C reaches the whole process group, workers stop on the sentinel
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=logging.WARNING)
+
+    Config.LEADERBOARD_GLOBAL_BOARDS = False
+    if Config.METRICS_PORT:
+        Config.METRICS_PORT += index
+    asyncio.run(_run_worker(index, workers, queue))
+
+
+async def _run_worker(index, workers, queue):
+
+    from telegram import Update
+    from bot import build_app
+
+    app = build_app(
+        primary=index == 0,
+        owns_chat=lambda chat_id: chat_id % workers == index
+    )
+
+    loop = asyncio.get_running_loop()
+
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+
+    try:
+        while True:
+            data = await loop.run_in_executor(None, queue.get)
+            if data is None:
+                break
+
+            await app.update_queue.put(Update.de_json(data, app.bot))
+    finally:
+        await app.stop()
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+
+# =========================
+# FRONT
+# =========================
+
+async def poll_updates(bot):
+
+    # Default update source: long polling, like Application.run_polling
+    await bot.delete_webhook(drop_pending_updates=True)
+    offset = 0
+
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=30)
+        except Exception:
+            logger.exception("get_updates failed")
+            await asyncio.sleep(1)
+            continue
+
+        for update in updates:
+            offset = update.update_id + 1
+            yield update.to_dict()
+
+
+async def dispatch(source, queues):
+    async for data in source:
+        queues[route(data, len(queues))].put(data)
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def run(workers, source_factory=None):
+
+    # source_factory: bot -> async iterable of update dicts. Defaults to
+    # polling the Bot API; anything else (e.g. a fake feed) can be plugged in
+    from telegram import Bot
+
+    queues = [_mp.Queue() for _ in range(workers)]
+    processes = [
+        _mp.Process(target=worker_main, args=(i, workers, queues[i]), name=f"worker-{i}")
+        for i in range(workers)
+    ]
+
+    for process in processes:
+        process.start()
+
+    signal.signal(signal.SIGTERM, _interrupt)
+
+    async def front():
+        kwargs = {"base_url": Config.BOT_API_URL} if Config.BOT_API_URL else {}
+        async with Bot(Config.BOT_TOKEN, **kwargs) as bot:
+            source = (source_factory or poll_updates)(bot)
+            await dispatch(source, queues)
+
+    try:
+        asyncio.run(front())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Each worker drains its queue, then flushes its buffer on shutdown
+        for queue in queues:
+            queue.put(None)
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the bot across worker processes")
+    parser.add_argument("--workers", type=int, default=Config.WORKERS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    Config.validate()
+    run(args.workers)